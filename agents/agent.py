@@ -3,6 +3,9 @@ import pandas as pd
 from util.logger import DummyLogger
 
 class Agent:
+    # Agents that queue work during a time slice set this to have flush_slice(current_time) called at its end
+    needs_slice_flush = False
+    
     def __init__(self, id:str):
         self._id = id
         self._kernel = None
@@ -16,6 +19,7 @@ class Agent:
     def kernel_init(self, kernel, logger=DummyLogger()):
         self._kernel = kernel
         self._logger = logger
+        self._journal = kernel.get_journal()
     
     def kernel_start(self, start_time):
         self._current_time = start_time
@@ -23,10 +27,21 @@ class Agent:
     def kernel_stop(self):
         pass
     
+    def release_workers(self):
+        """ Bring back the state held by worker processes, called before the kernel forks """
+        pass
+    
+    def flush_slice(self, current_time):
+        pass
+    
     # Communication methods
     def receive_message(self, current_time, message):
         self._current_time = current_time
     
     def send_message(self, recipient_id, message, delay = pd.Timedelta(seconds=0)):
         self._kernel.send_message(self.id, recipient_id, message, delay = delay)
+    
+    def set_timer(self, interval, callback, start_time=None):
+        """ Register a recurring callback(current_time) with the kernel """
+        return self._kernel.schedule_timer(callback, interval, start_time)
         
\ No newline at end of file
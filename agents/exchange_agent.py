@@ -1,8 +1,10 @@
-from typing import List
-import copy 
+from typing import Dict, List, Union
+import logging
+import multiprocessing
 import pandas as pd
 
 from agents.agent import Agent
+from market_engine.exchange_shard import ORDER_MESSAGES, ExchangeShard, ShardProcess, shard_symbols
 from market_engine.order_book import OrderBook
 from market_engine.order import LimitOrder
 from market_engine.market_analytics import MarketAnalytics
@@ -10,54 +12,266 @@ from util.message import Message
 from util.types import MessageType
 from util.logger import DummyLogger
 
+# Journal order kinds of the order messages, see util.journal.ORDER_KINDS
+_ORDER_KINDS = {MessageType.LIMIT_ORDER: 0, MessageType.MARKET_ORDER: 1, MessageType.CANCEL_ORDER: 2, MessageType.MODIFY_ORDER: 3}
+
 
 class ExchangeAgent(Agent):
-    def __init__(self, id:str, symbol:str):
+    def __init__(self, id:str, symbol:Union[str, List[str]], analytics_interval=pd.Timedelta(seconds=0.1), tick_size:Union[float, Dict[str, float]]=0.01,
+                 analytics_retention:int=10000, num_shards:int=1, observation_length:int=0):
+        """ Exchange hosting one order book per symbol, symbol is a symbol or a list of them (the first one is the default)
+
+        tick_size is the tick size of every book or a symbol -> tick size mapping covering every symbol.
+
+        With num_shards > 1 the books are spread over that many worker processes. Order messages are then
+        queued during each time slice of the kernel and flushed to every shard at once at its end, the
+        shards match in parallel and their reports are delivered within the same slice. Analytics are
+        kept by the exchange on the book depths the shards send back at each analytics tick. In a daemon
+        process, which cannot start workers, the books are matched in that process instead.
+
+        With observation_length > 0 the market data views also carry the (observation_length, 4, 5)
+        observation tensor of the RL agents.
+        """
         super().__init__(id)
-        self.symbol = symbol
-        self._market_analytics = MarketAnalytics(self.symbol, depth = 5)
-    
+        self.symbols = [symbol] if isinstance(symbol, str) else list(symbol)
+        self.symbol = self.symbols[0]
+        if isinstance(tick_size, dict):
+            missing = [symbol for symbol in self.symbols if symbol not in tick_size]
+            if missing:
+                raise ValueError(f"No tick size for {', '.join(missing)}")
+        self.tick_size = tick_size
+        self._analytics = {symbol: MarketAnalytics(symbol, depth = 5, retention = analytics_retention,
+                                                           observation_length = observation_length) for symbol in self.symbols}
+        self._market_analytics = self._analytics[self.symbol]
+        self._analytics_interval = analytics_interval
+        self.num_shards = min(max(num_shards, 1), len(self.symbols))
+        self._shard = None
+        self._shards: List[ShardProcess] = None
+        self._shard_books: Dict[str, OrderBook] = None
+        self._analytics_due = False
+        self._pending_requests = []
+
+    @property
+    def needs_slice_flush(self):
+        return self.num_shards > 1
+
     def kernel_init(self, kernel, logger=DummyLogger()):
         super().kernel_init(kernel, logger)
         self._oracle = self._kernel._oracle
-        self._order_book = OrderBook(self.symbol, self, self._logger)
-    
+        self.close_shards()
+        books = {symbol: OrderBook(symbol, self, self._logger, self.tick_size_of(symbol)) for symbol in self.symbols}
+        if self.num_shards > 1:
+            # Books are handed to the shard processes when they start
+            self._shard = None
+            self._order_book = None
+            self._shard_books = books
+        else:
+            self._shard = ExchangeShard(books, self)
+            self._order_book = books[self.symbol]
+
+    def kernel_start(self, start_time):
+        super().kernel_start(start_time)
+        self.set_timer(self._analytics_interval, self._on_analytics_timer, start_time)
+
+    def kernel_stop(self):
+        super().kernel_stop()
+        self.close_shards()
+
+    def tick_size_of(self, symbol:str) -> float:
+        return self.tick_size[symbol] if isinstance(self.tick_size, dict) else self.tick_size
+
+    def get_order_book(self, symbol:str=None) -> OrderBook:
+        """ Book of a symbol (default the first one), only available when the books are in this process
+
+        With shards that is before they start and after close_shards, which kernel_stop calls at the end of a run.
+        """
+        if self._shard is not None:
+            return self._shard.books[symbol or self.symbol]
+        if self._shards is None and self._shard_books is not None:
+            return self._shard_books[symbol or self.symbol]
+        raise RuntimeError("The order books are held by the shard processes")
+
+    def get_market_analytics(self, symbol:str=None) -> MarketAnalytics:
+        return self._analytics[symbol or self.symbol]
+
     def receive_market_orders(self, current_time, market_orders:List[LimitOrder]):
         self._current_time = current_time
         for market_order in market_orders:
-            self._order_book.send_order(market_order)        
-    
+            self._route(Message(MessageType.LIMIT_ORDER, market_order))
+
     def receive_message(self, current_time, message):
         super().receive_message(current_time, message)
         #self.logger.info(f"Exchange agent {self.id} received message {message}")
-        
+
         message_type = message.type
-        if message_type in [MessageType.LIMIT_ORDER, MessageType.MARKET_ORDER]:
-            self._order_book.send_order(message.content)
-        #elif message_type == MessageType.CANCEL_ORDER:
-        #    self.order_book.cancel_order(message.content["order_id"])
-        #elif message_type == MessageType.MODIFY_ORDER:
-        #    self.order_book.modify_order(message.content["order"])
+        if message_type in ORDER_MESSAGES:
+            if self._journal.orders is not None:
+                self._journal_order(message_type, message.content)
+            self._route(message)
         elif message_type == MessageType.REQUEST_MARKET_DATA:
-            market_data = copy.deepcopy(self._market_analytics)
-            response_message = Message(MessageType.MARKET_DATA, market_data)
-            self.send_message(message.content, response_message)
-            
+            if self._analytics_due:
+                # Answered once the shards sent the depths of this analytics tick
+                self._pending_requests.append(message.content)
+                return
+            self._send_market_data(message.content)
+
+    def _send_market_data(self, content):
+        # A versioned view shares the analytics history instead of copying it, one view per requested symbol
+        if isinstance(content, str):
+            agent_id, symbols = content, (self.symbol,)
+        else:
+            agent_id, symbols = content["agent_id"], content.get("symbols") or (self.symbol,)
+        for symbol in symbols:
+            analytics = self._analytics.get(symbol)
+            if analytics is not None:
+                self.send_message(agent_id, Message(MessageType.MARKET_DATA, analytics.view()))
+
+    def _route(self, message:Message):
+        if self._shard is None and self._shards is None:
+            self._start_shards()
+        if self._shard is not None:
+            self._shard.handle(message)
+            return
+        content = message.content
+        symbol = content.symbol if not isinstance(content, dict) else content.get("symbol", self.symbol)
+        self._shard_index[symbol].pending.append(message)
+
+    # Sharding methods
+    def _start_shards(self):
+        books = self._shard_books
+        self._shard_books = None
+        if multiprocessing.current_process().daemon:
+            # Daemon processes (forked rollouts, pool and env workers) cannot start children, the books are matched here
+            self._shard = ExchangeShard(books, self)
+            self._order_book = books[self.symbol]
+            return
+        self._shards = [ShardProcess({symbol: books[symbol] for symbol in group}) for group in shard_symbols(self.symbols, self.num_shards)]
+        self._shard_index = {symbol: shard for shard in self._shards for symbol in shard.symbols}
+
+    def flush_slice(self, current_time):
+        """ Send the order messages queued during the time slice to the shards and deliver what comes back """
+        if self._shards is None:
+            if not self._analytics_due:
+                return
+            self._start_shards()
+            if self._shard is not None:
+                self.update_market_analytics()
+                self._answer_pending_requests()
+                return
+        depth = self._market_analytics.depth if self._analytics_due else 0
+        active = [shard for shard in self._shards if shard.pending or depth]
+        for shard in active:
+            shard.submit(depth)
+        self._current_time = current_time
+        for shard in active:
+            messages, depths = shard.collect()
+            for recipient_id, message in messages:
+                self.send_message(recipient_id, message)
+            if depths is not None:
+                for symbol, (mid_price, bids, asks) in depths.items():
+                    self._analytics[symbol].update_levels(current_time, mid_price, bids, asks)
+        if depth:
+            self._record_analytics()
+            self._answer_pending_requests()
+
+    def _answer_pending_requests(self):
+        self._analytics_due = False
+        requests, self._pending_requests = self._pending_requests, []
+        for content in requests:
+            self._send_market_data(content)
+
+    def release_workers(self):
+        """ Take the books back before the kernel forks, so that forked processes do not drive the same shards """
+        self.close_shards()
+
+    def close_shards(self):
+        """ Stop the shard processes and take their books back, the shards are started again if the exchange is used """
+        if self._shards is not None:
+            books = {}
+            for shard in self._shards:
+                books.update(shard.books())
+                shard.stop()
+            for book in books.values():
+                book.set_owner(self)
+            self._shard_books = books
+            self._shards = None
+            self._shard_index = None
+
+    def __getstate__(self):
+        """ Copies and pickles take the books back from the shard processes, the copy starts its own shards when used """
+        state = self.__dict__.copy()
+        if self._shards is not None:
+            books = {}
+            for shard in self._shards:
+                books.update(shard.books())
+            state['_shard_books'] = books
+            state['_shards'] = None
+            state.pop('_shard_index', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._shard_books is not None:
+            for book in self._shard_books.values():
+                book.set_owner(self)
+
+    def _journal_order(self, message_type, content):
+        time = self._current_time.value
+        if message_type in (MessageType.LIMIT_ORDER, MessageType.MARKET_ORDER):
+            price = content.limit_price if message_type == MessageType.LIMIT_ORDER else float("nan")
+            self._journal.orders.record(time, self._journal.code(content.agent_id), content.order_id, _ORDER_KINDS[message_type],
+                                        content.side, price, content.quantity)
+        else:
+            # cancels and modifies only carry the order id, the agent is resolved from the book if the order rests there
+            book = self._shard.book_of(content) if self._shard is not None else None
+            order = book.get_order(content["order_id"]) if book is not None else None
+            agent = self._journal.code(order.agent_id) if order is not None else -1
+            side = order.side if order is not None else -1
+            self._journal.orders.record(time, agent, content["order_id"], _ORDER_KINDS[message_type], side, float("nan"), content.get("quantity", 0))
+
     def send_message(self, recipient_id, message, delay=pd.Timedelta(seconds=0)):
+        if self._journal.fills is not None and message.type == MessageType.ORDER_EXECUTED:
+            report = message.content
+            self._journal.fills.record_many({"time": self._current_time.value, "agent": self._journal.code(report.agent_id),
+                                             "order_id": report.order_ids, "side": report.sides, "price": report.prices,
+                                             "quantity": report.quantities, "fee": report.fees}, len(report))
         if recipient_id != "Market":
-            self._logger.info(f"Exchange agent {self.id} sent message {message} to {recipient_id}")
+            self._logger.info("Exchange agent %s sent message %s to %s", self.id, message, recipient_id)
             message_type = message.type
             if message_type in [MessageType.ORDER_ACCEPTED, MessageType.ORDER_CANCELLED, MessageType.ORDER_EXECUTED, MessageType.MARKET_DATA]:
                 super().send_message(recipient_id, message, delay)
-    
+
+    def _on_analytics_timer(self, current_time):
+        self._current_time = current_time
+        self.update_market_analytics()
+
     def update_market_analytics(self):
-        self._market_analytics.update(self._current_time, self._order_book)
+        if self._shard is None:
+            # The depths come back with the flush at the end of the slice
+            self._analytics_due = True
+            return
+        for symbol, book in self._shard.books.items():
+            self._analytics[symbol].update(self._current_time, book)
+        self._record_analytics()
+
+    def _record_analytics(self):
+        if self._journal.book is not None:
+            for symbol, analytics in self._analytics.items():
+                history = analytics.history
+                row = history.row(history.version - 1)
+                self._journal.book.record(self._current_time.value, self._journal.code(symbol),
+                                          history.bid_prices[row, 0], history.bid_volumes[row, 0],
+                                          history.ask_prices[row, 0], history.ask_volumes[row, 0], history.mid_prices[row])
         self.log_order_book()
 
     def log_order_book(self, analytics=True):
-        self._logger.info(f"Order book at time {self._current_time}")
-        self._logger.info(self._order_book.__str__(depth=5))
+        # Rendering the book is only worth it when the record is actually written
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+        self._logger.info("Order book at time %s", self._current_time)
+        if self._shard is not None:
+            for book in self._shard.books.values():
+                self._logger.info(book.__str__(depth=5))
         if analytics:
-            self._logger.info(self._market_analytics.__str__())
-
-
+            for market_analytics in self._analytics.values():
+                self._logger.info("%s", market_analytics)
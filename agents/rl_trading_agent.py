@@ -78,6 +78,11 @@ class RL_Agent(TradingAgent):
             reward_estimation=dict(horizon=1)
         )
 
+    def get_state(self):
+        """ (T, 4, N) state of the last market data, a read-only view of the exchange's observation tensor (see ExchangeAgent observation_length) """
+        market_data = self.get_market_data()
+        return market_data.observation() if market_data is not None else None
+
     def decide_action(self, state):
         """ Décide de l'action à prendre basée sur l'état actuel en utilisant Dueling DQN """
         action = self.agent.act(states=state)
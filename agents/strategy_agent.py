@@ -0,0 +1,99 @@
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+from agents.trading_agent import TradingAgent
+from datamodel import Listing, Observation, Order, OrderDepth, Trade, TradingState
+from util.types import Side
+
+# Buyer or seller name of the strategy's own side of a trade
+SUBMISSION = "SUBMISSION"
+
+
+class StrategyAgent(TradingAgent):
+    def __init__(self, id:str, trader, starting_cash=100000, symbol:str="BTC", symbols:List[str]=None,
+                 position_limit:float=None, wake_up_interval=pd.Timedelta(seconds=0.5)):
+        """ Runs a trader.py strategy in the kernel, trader.run(state) is called at each wake up
+
+        The TradingState holds the order depth of every symbol from the last market data, the fills
+        since the previous run as own trades and the current positions. Orders live for one iteration:
+        those still open are cancelled before the new ones are sent. With a position_limit, all the
+        orders of a symbol are dropped when they could take the position beyond it.
+        """
+        super().__init__(id, starting_cash, wake_up_interval=wake_up_interval, symbol=symbol, symbols=symbols)
+        self.trader = trader
+        self.position_limit = position_limit
+        self._trader_data = ""
+        self._new_fills = []  # execution reports since the last TradingState, handed to the strategy as own trades
+
+    def handle_wake_up(self, current_time):
+        super().handle_wake_up(current_time)
+        state = self.trading_state(current_time)
+        if not state.order_depths:
+            return
+        output = self.trader.run(state)
+        # run returns (orders, traderData, conversions), or only the orders for the older interface
+        if isinstance(output, tuple):
+            orders, self._trader_data = output[0], output[1]
+        else:
+            orders = output
+        for order_id in list(self._orders):
+            self.cancel_order(order_id)
+        for symbol, symbol_orders in (orders or {}).items():
+            self._send_orders(symbol, symbol_orders)
+
+    def handle_execution_report(self, report):
+        self._new_fills.append(report)
+
+    def trading_state(self, current_time) -> TradingState:
+        order_depths = {}
+        for symbol in self._symbols:
+            market_data = self.get_market_data(symbol)
+            if market_data is not None and market_data.version:
+                order_depths[symbol] = self._order_depth(market_data)
+        own_trades = {symbol: [] for symbol in self._symbols}
+        timestamp = current_time.value
+        for report in self._new_fills:
+            trades = own_trades.setdefault(report.symbol, [])
+            for side, quantity, price in zip(report.sides.tolist(), report.quantities.tolist(), report.prices.tolist()):
+                buyer, seller = (SUBMISSION, "") if side == Side.BUY else ("", SUBMISSION)
+                trades.append(Trade(report.symbol, price, quantity, buyer, seller, timestamp))
+        self._new_fills = []
+        return TradingState(
+            traderData=self._trader_data,
+            timestamp=timestamp,
+            listings={symbol: Listing(symbol, symbol, "USD") for symbol in self._symbols},
+            order_depths=order_depths,
+            own_trades=own_trades,
+            market_trades={symbol: [] for symbol in self._symbols},
+            position={symbol: self._current_positions[symbol] for symbol in self._symbols},
+            observations=Observation(),
+        )
+
+    @staticmethod
+    def _order_depth(market_data) -> OrderDepth:
+        """ OrderDepth of the last snapshot of a market data view, read straight from its history row """
+        window = market_data.window(1)
+        bid_prices, bid_volumes = window['bid_prices'][0], window['bid_volumes'][0]
+        ask_prices, ask_volumes = window['ask_prices'][0], window['ask_volumes'][0]
+        # Missing levels are NaN and only ever at the end of a row
+        bid_count = np.count_nonzero(~np.isnan(bid_prices))
+        ask_count = np.count_nonzero(~np.isnan(ask_prices))
+        return OrderDepth(dict(zip(bid_prices[:bid_count].tolist(), bid_volumes[:bid_count].tolist())),
+                          dict(zip(ask_prices[:ask_count].tolist(), (-ask_volumes[:ask_count]).tolist())))
+
+    def _send_orders(self, symbol:str, orders:List[Order]):
+        orders = [order for order in orders if order.quantity]
+        if self.position_limit is not None:
+            position = self._current_positions[symbol]
+            buys = sum(order.quantity for order in orders if order.quantity > 0)
+            sells = sum(order.quantity for order in orders if order.quantity < 0)
+            if position + buys > self.position_limit or position + sells < -self.position_limit:
+                self._logger.info("Agent %s dropped the orders of %s exceeding the position limit", self.id, symbol)
+                return
+        for order in orders:
+            side = Side.BUY if order.quantity > 0 else Side.SELL
+            self.place_limit_order(symbol, abs(order.quantity), side, order.price)
+
+    def get_results(self) -> Dict:
+        return {**super().get_results(), "trader_data": self._trader_data}
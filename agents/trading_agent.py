@@ -1,15 +1,18 @@
+from typing import List
 from collections import defaultdict
 from copy import deepcopy
 import pandas as pd
 
 from agents.agent import Agent
-from market_engine.order import LimitOrder, MarketOrder, FilledOrder
+from market_engine.order import LimitOrder, MarketOrder, ExecutionReport
 from util.types import Side, MessageType
 from util.message import Message
 
 class TradingAgent(Agent):
     
-    def __init__(self, id:str, starting_cash=100000):
+    def __init__(self, id:str, starting_cash=100000, data_request_interval=pd.Timedelta(seconds=0.1), wake_up_interval=pd.Timedelta(seconds=0.5),
+                 symbol:str="BTC", symbols:List[str]=None):
+        """ Agent trading symbol, market data is requested for symbols (default only symbol) """
         super().__init__(id)
         
         # Agent internal 
@@ -18,13 +21,22 @@ class TradingAgent(Agent):
         self._cash_balance = starting_cash
         self._current_positions = defaultdict(int)
         self._pending_positions = defaultdict(int)
+        self._fill_stats = {} # running fill totals by symbol, the reports themselves are not kept
         self._market_data = None
+        self._market_data_by_symbol = {}
         self._hyperparameters = None
-        self._symbol = "BTC"
+        self._symbol = symbol
+        self._symbols = list(symbols) if symbols is not None else [symbol]
+        
+        # Recurring timers
+        self._data_request_interval = data_request_interval
+        self._wake_up_interval = wake_up_interval
     
     def kernel_start(self, start_time):
         self._exchange_id = self._kernel.get_exchange_id()
         super().kernel_start(start_time)
+        self.set_timer(self._data_request_interval, self._on_data_request_timer, start_time)
+        self.set_timer(self._wake_up_interval, self._on_wake_up_timer, start_time)
     
     def kernel_stop(self):
         super().kernel_stop()
@@ -43,44 +55,84 @@ class TradingAgent(Agent):
         super().receive_message(current_time, message)
         msg_type = message.type
         if msg_type == MessageType.ORDER_EXECUTED:
-            filled_order:FilledOrder = message.content
-            self._cash_balance += filled_order.fee # positive for maker, negative for taker
-            if filled_order.side == Side.BUY:
-                self._current_positions[filled_order.symbol] += filled_order.filled_quantity
-                self._cash_balance -= filled_order.filled_quantity * filled_order.filled_price
-            elif filled_order.side == Side.SELL:
-                self._current_positions[filled_order.symbol] -= filled_order.filled_quantity
-                self._cash_balance += filled_order.filled_quantity * filled_order.filled_price
-            self._pending_positions[filled_order.symbol] -= filled_order.filled_quantity
-            self._logger.info(f"Agent {self.id} received filled order {filled_order}")
+            report:ExecutionReport = message.content
+            signed_quantities = report.signed_quantities()
+            net_quantity = signed_quantities.sum().item()
+            self._cash_balance += report.fees.sum().item() # positive for maker, negative for taker
+            self._cash_balance -= (signed_quantities * report.prices).sum().item()
+            self._current_positions[report.symbol] += net_quantity
+            self._pending_positions[report.symbol] -= net_quantity
+            self._record_fills(report)
+            # forget orders once they are completely filled
+            for order_id, quantity in zip(report.order_ids.tolist(), report.quantities.tolist()):
+                order = self._orders.get(order_id)
+                if order is not None:
+                    order.remaining_quantity -= quantity
+                    if order.remaining_quantity <= 0:
+                        del self._orders[order_id]
+            self._logger.info("Agent %s received execution report %s", self.id, report)
+            self.handle_execution_report(report)
         elif msg_type == MessageType.ORDER_CANCELLED:
             order_id = message.content
-            order = self._orders[order_id]
-            self._pending_positions[order.symbol] -= order.quantity
-            del self._orders[order_id]
-            self._logger.info(f"Agent {self.id} received cancelled order {order}")
+            order = self._orders.pop(order_id, None)
+            if order is None:
+                return
+            self._pending_positions[order.symbol] -= order.remaining_quantity if order.side == Side.BUY else -order.remaining_quantity
+            self._logger.info("Agent %s received cancelled order %s", self.id, order)
         elif msg_type == MessageType.MARKET_DATA:
             self.handle_market_data(message.content)
         elif msg_type == MessageType.WAKE_UP:
             self.handle_wake_up(current_time)
             
+    def _record_fills(self, report:ExecutionReport):
+        stats = self._fill_stats.get(report.symbol)
+        if stats is None:
+            stats = self._fill_stats[report.symbol] = {"fills": 0, "bought": 0.0, "sold": 0.0, "buy_notional": 0.0, "sell_notional": 0.0, "fees": 0.0}
+        is_buy = report.sides == Side.BUY
+        notional = report.quantities * report.prices
+        stats["fills"] += len(report)
+        stats["bought"] += report.quantities[is_buy].sum().item()
+        stats["sold"] += report.quantities[~is_buy].sum().item()
+        stats["buy_notional"] += notional[is_buy].sum().item()
+        stats["sell_notional"] += notional[~is_buy].sum().item()
+        stats["fees"] += report.fees.sum().item()
+    
+    def handle_execution_report(self, report:ExecutionReport):
+        """ Called with each execution report once cash, positions and open orders are updated """
+        pass
+    
     def handle_market_data(self, market_data):
-        self._market_data = market_data   
-        self._logger.info(f"Agent {self.id} received market data at {self._current_time}")        
+        self._market_data_by_symbol[market_data.symbol] = market_data
+        if market_data.symbol == self._symbol:
+            self._market_data = market_data
+        self._logger.info("Agent %s received market data at %s", self.id, self._current_time)        
     
     def handle_wake_up(self, current_time):
-        self._logger.info(f"Agent {self.id} woke up at {self._current_time}")
-        self._logger.info(f"Agent {self.id} cash balance: {self._cash_balance}")    
+        self._logger.info("Agent %s woke up at %s", self.id, self._current_time)
+        self._logger.info("Agent %s cash balance: %s", self.id, self._cash_balance)
+        if self._journal.agent_state is not None:
+            agent = self._journal.code(self.id)
+            for symbol, position in self._current_positions.items():
+                self._journal.agent_state.record(current_time.value, agent, self._journal.code(symbol), self._cash_balance,
+                                                 position, self._pending_positions[symbol])
+    
+    def _on_data_request_timer(self, current_time):
+        self._current_time = current_time
+        self.request_market_data()
+    
+    def _on_wake_up_timer(self, current_time):
+        self._current_time = current_time
+        self.request_wake_up()
     
     def request_market_data(self):
-        message = Message(MessageType.REQUEST_MARKET_DATA, self.id)
+        message = Message(MessageType.REQUEST_MARKET_DATA, {"agent_id": self.id, "symbols": self._symbols})
         self.send_message(self._exchange_id, message)
-        self._logger.info(f"Agent {self.id} requested market data")
+        self._logger.info("Agent %s requested market data", self.id)
     
     def request_wake_up(self):
         message = Message(MessageType.WAKE_UP, self.id)
         self.send_message(self.id, message)
-        self._logger.info(f"Agent {self.id} requested wake up")
+        self._logger.info("Agent %s requested wake up", self.id)
         
     def place_limit_order(self, symbol:str, quantity:int, side:Side, limit_price:int):
         order = LimitOrder(self._id, self._current_time, symbol, quantity, side, limit_price)
@@ -91,7 +143,7 @@ class TradingAgent(Agent):
         # send order to exchange
         message = Message(MessageType.LIMIT_ORDER, order)
         self.send_message(self._exchange_id, message)
-        self._logger.info(f"Agent {self.id} placed limit order {order}")
+        self._logger.info("Agent %s placed limit order %s", self.id, order)
     
     def place_market_order(self, symbol:str, quantity:int, side:Side): 
         order = MarketOrder(self.id, self._current_time, symbol, quantity, side) 
@@ -102,8 +154,46 @@ class TradingAgent(Agent):
         # send order to exchange
         message = Message(MessageType.MARKET_ORDER, order)
         self.send_message(self._exchange_id, message)
-        self.logger.info(f"Agent {self.id} placed market order {order}")
+        self._logger.info("Agent %s placed market order %s", self.id, order)
         
-    def get_market_data(self):
-        return self._market_data
+    def cancel_order(self, order_id:int):
+        order = self._orders.get(order_id)
+        message = Message(MessageType.CANCEL_ORDER, {"order_id": order_id, "symbol": order.symbol if order is not None else self._symbol, "agent_id": self.id})
+        self.send_message(self._exchange_id, message)
+        self._logger.info("Agent %s requested cancel of order %s", self.id, order_id)
+    
+    def modify_order(self, order_id:int, quantity):
+        """ Reduce the remaining quantity of a resting order, keeping its queue position """
+        order = self._orders.get(order_id)
+        if order is None or quantity >= order.remaining_quantity:
+            return
+        if quantity > 0:
+            reduction = order.remaining_quantity - quantity
+            self._pending_positions[order.symbol] -= reduction if order.side == Side.BUY else -reduction
+            order.remaining_quantity = quantity
+        message = Message(MessageType.MODIFY_ORDER, {"order_id": order_id, "quantity": quantity, "symbol": order.symbol, "agent_id": self.id})
+        self.send_message(self._exchange_id, message)
+        self._logger.info("Agent %s requested modify of order %s to %s", self.id, order_id, quantity)
+    
+    def get_open_orders(self):
+        return self._orders
+    
+    def get_market_data(self, symbol:str=None):
+        """ Last market data view of a symbol, by default the traded one """
+        if symbol is None or symbol == self._symbol:
+            return self._market_data
+        return self._market_data_by_symbol.get(symbol)
+    
+    def get_results(self):
+        """ Summary of the agent's trading, picklable so that it can be collected from worker processes
+
+        fills holds the fill count, quantities and notionals bought and sold and the fees of each symbol, totals
+        rather than every fill so that long runs do not keep their reports. The journal records individual fills.
+        """
+        return {
+            "agent_id": self.id,
+            "cash": self._cash_balance,
+            "positions": dict(self._current_positions),
+            "fills": {symbol: dict(stats) for symbol, stats in self._fill_stats.items()},
+        }
         
\ No newline at end of file
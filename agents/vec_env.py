@@ -0,0 +1,266 @@
+from typing import Callable, Dict, List, Tuple
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+from agents.trading_agent import TradingAgent
+from kernel import Kernel
+from util.types import Side
+
+# Observation channels, in the order of the second axis of the (T, 4, levels) observations
+CHANNELS = ('bid_prices', 'bid_volumes', 'ask_prices', 'ask_volumes')
+BUY, SELL, BOTH = 0, 1, 2
+
+
+class ExternalAgent(TradingAgent):
+    def __init__(self, id:str, starting_cash=100000, symbol:str="BTC", order_quantity:float=0.01, levels:int=5):
+        """ Trading agent whose orders are decided outside of the kernel, one action per environment step
+
+        Action a in [0, 3 * levels) quotes level a % levels of the last market data: a // levels is BUY
+        for a buy at that bid price, SELL for a sell at that ask price and BOTH for both. Orders still
+        open from the previous step are cancelled first.
+        """
+        super().__init__(id, starting_cash, symbol=symbol)
+        self.order_quantity = order_quantity
+        self.levels = levels
+
+    @property
+    def num_actions(self):
+        return 3 * self.levels
+
+    def apply_action(self, current_time, action:int):
+        self._current_time = current_time
+        for order_id in list(self._orders):
+            self.cancel_order(order_id)
+        market_data = self.get_market_data()
+        if market_data is None or not market_data.version:
+            return
+        kind, level = divmod(int(action), self.levels)
+        window = market_data.window(1)
+        if kind in (BUY, BOTH):
+            price = window['bid_prices'][0, level]
+            if not np.isnan(price):
+                self.place_limit_order(self._symbol, self.order_quantity, Side.BUY, price.item())
+        if kind in (SELL, BOTH):
+            price = window['ask_prices'][0, level]
+            if not np.isnan(price):
+                self.place_limit_order(self._symbol, self.order_quantity, Side.SELL, price.item())
+
+    def portfolio_value(self) -> float:
+        """ Cash plus the position marked at the last mid price """
+        market_data = self.get_market_data()
+        if market_data is None or not market_data.version:
+            return self._cash_balance
+        mid_price = market_data.last_prices(1)[0]
+        position = self._current_positions[self._symbol]
+        return self._cash_balance + (position * mid_price if not np.isnan(mid_price) else 0.0)
+
+    def observe(self, out:np.ndarray):
+        """ Write the last T snapshots of the market data into out, a (T, 4, levels) array
+
+        Rows are oldest first, rows before the first snapshot are zero and so are missing levels.
+        The observation tensor of the exchange is copied as is when it has the shape of out.
+        """
+        market_data = self.get_market_data()
+        if market_data is None or not market_data.version:
+            out[:] = 0
+            return
+        observation = market_data.observation()
+        if observation is not None and observation.shape == out.shape:
+            out[:] = observation
+            return
+        out[:] = 0
+        window = market_data.window(out.shape[0])
+        length = len(window['timestamps'])
+        levels = min(out.shape[2], market_data.depth)
+        for channel, name in enumerate(CHANNELS):
+            out[-length:, channel, :levels] = window[name][:, :levels]
+        np.nan_to_num(out, copy=False)
+
+
+class _Env:
+    """ One kernel stepped by a fixed interval of simulated time """
+
+    def __init__(self, make_env:Callable, index:int, step_interval):
+        self._make_env = make_env
+        self.index = index
+        self.step_interval = step_interval
+        self.kernel = None
+        self.agent = None
+        self.episodes = 0
+
+    def reset(self):
+        self.close()
+        oracle, exchange_agent, trading_agent = self._make_env(self.index)
+        self.kernel = Kernel()
+        self.kernel.pre_run(oracle, exchange_agent, trading_agent)
+        self.agent = trading_agent
+        # The first observation is taken one interval in, once there is market data
+        self.kernel.run_for(self.step_interval)
+        self._value = self.agent.portfolio_value()
+        self.episodes += 1
+
+    def step(self, action:int) -> Tuple[float, bool]:
+        self.agent.apply_action(self.kernel.get_current_time(), action)
+        running = self.kernel.run_for(self.step_interval)
+        value = self.agent.portfolio_value()
+        reward, self._value = value - self._value, value
+        return reward, not running
+
+    def close(self):
+        """ Stop the agents of the current episode, which shuts down the shard processes of a sharded exchange """
+        if self.kernel is not None:
+            self.kernel.stop()
+
+
+class _EnvGroup:
+    """ Envs stepped one after another in the same process """
+
+    def __init__(self, make_env:Callable, indices:List[int], step_interval, window:int, levels:int):
+        self.envs = [_Env(make_env, index, step_interval) for index in indices]
+        self.observations = np.zeros((len(indices), window, len(CHANNELS), levels), dtype=np.float32)
+
+    def reset(self) -> np.ndarray:
+        for env, out in zip(self.envs, self.observations):
+            env.reset()
+            env.agent.observe(out)
+        return self.observations
+
+    def step(self, actions) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        rewards = np.zeros(len(self.envs))
+        dones = np.zeros(len(self.envs), dtype=bool)
+        for i, (env, action) in enumerate(zip(self.envs, actions)):
+            rewards[i], dones[i] = env.step(action)
+            if dones[i]:
+                env.reset()
+            env.agent.observe(self.observations[i])
+        return self.observations, rewards, dones
+
+    def results(self) -> List[Dict]:
+        return [{"env": env.index, "episodes": env.episodes, **env.agent.get_results()} for env in self.envs]
+
+    def close(self):
+        for env in self.envs:
+            env.close()
+
+
+def _run_env_group(connection, make_env, indices, step_interval, window, levels):
+    group = _EnvGroup(make_env, indices, step_interval, window, levels)
+    while True:
+        command, payload = connection.recv()
+        if command == "reset":
+            connection.send(group.reset())
+        elif command == "step":
+            connection.send(group.step(payload))
+        elif command == "results":
+            connection.send(group.results())
+        elif command == "stop":
+            group.close()
+            connection.close()
+            return
+
+
+class _EnvProcess:
+    """ Worker process stepping an _EnvGroup, send and receive are split so that workers step in parallel """
+
+    def __init__(self, make_env:Callable, indices:List[int], step_interval, window:int, levels:int):
+        self.indices = indices
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self._connection, child = context.Pipe()
+        self._process = context.Process(target=_run_env_group, args=(child, make_env, indices, step_interval, window, levels), daemon=True)
+        self._process.start()
+        child.close()
+
+    def send(self, command:str, payload=None):
+        self._connection.send((command, payload))
+
+    def receive(self):
+        return self._connection.recv()
+
+    def stop(self):
+        if self._process.is_alive():
+            self._connection.send(("stop", None))
+            self._process.join()
+        self._connection.close()
+
+
+class VecEnv:
+    """ num_envs independent simulations stepped in lockstep, for batched RL training
+
+    make_env(index) returns a fresh (oracle, exchange_agent, trading_agent) for env index, the trading
+    agent being an ExternalAgent (an exchange with observation_length=window saves rebuilding the
+    observations from the history at each step), and is called again whenever that env starts a new episode. Every step
+    applies one action per env and advances each kernel by step_interval of simulated time. Observations
+    are stacked into a float32 (num_envs, window, 4, levels) array holding, per env, the last window
+    snapshots of bid prices, bid volumes, ask prices and ask volumes of its agent's market data (the
+    states layout of rl_trading_agent.agent_config). The reward is the change in the agent's portfolio
+    value over the step. An env whose episode ended is reset within the step: its done flag is set and
+    its observation is the first one of the next episode. reset and step return a new observations array
+    each time, as gym and SB3 envs do, so that the caller can keep them in a rollout buffer.
+
+    With num_workers > 1 the envs are spread over that many forked worker processes stepping in
+    parallel, make_env then only runs in the workers and need not be picklable where processes fork.
+    """
+
+    def __init__(self, make_env:Callable, num_envs:int, step_interval=pd.Timedelta(seconds=0.5), window:int=10, levels:int=5,
+                 num_workers:int=1):
+        self.num_envs = num_envs
+        self.window = window
+        self.levels = levels
+        self.num_workers = min(max(num_workers, 1), num_envs)
+        groups = [list(range(num_envs))[i::self.num_workers] for i in range(self.num_workers)]
+        if self.num_workers > 1:
+            self._group = None
+            self._workers = [_EnvProcess(make_env, indices, step_interval, window, levels) for indices in groups]
+        else:
+            self._group = _EnvGroup(make_env, groups[0], step_interval, window, levels)
+            self._workers = []
+        self.observations = np.zeros((num_envs, window, len(CHANNELS), levels), dtype=np.float32)
+
+    @property
+    def observation_shape(self):
+        return (self.window, len(CHANNELS), self.levels)
+
+    def reset(self) -> np.ndarray:
+        """ Start a new episode in every env and return the (num_envs, window, 4, levels) observations """
+        if self._group is not None:
+            return self._group.reset().copy()
+        for worker in self._workers:
+            worker.send("reset")
+        for worker in self._workers:
+            self.observations[worker.indices] = worker.receive()
+        return self.observations.copy()
+
+    def step(self, actions) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Apply one action per env and return the observations, rewards and done flags after the step """
+        actions = np.asarray(actions)
+        if self._group is not None:
+            observations, rewards, dones = self._group.step(actions)
+            return observations.copy(), rewards, dones
+        for worker in self._workers:
+            worker.send("step", actions[worker.indices])
+        rewards = np.zeros(self.num_envs)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        for worker in self._workers:
+            self.observations[worker.indices], rewards[worker.indices], dones[worker.indices] = worker.receive()
+        return self.observations.copy(), rewards, dones
+
+    def get_results(self) -> List[Dict]:
+        """ Trading agent results of the current episode of every env, with the number of episodes it started """
+        if self._group is not None:
+            return self._group.results()
+        for worker in self._workers:
+            worker.send("results")
+        results = [result for worker in self._workers for result in worker.receive()]
+        return sorted(results, key=lambda result: result["env"])
+
+    def close(self):
+        if self._group is not None:
+            self._group.close()
+        for worker in self._workers:
+            worker.stop()
+        self._workers = []
@@ -0,0 +1,62 @@
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+# Order kinds of a synthetic flow
+LIMIT, MARKET, CANCEL = 0, 1, 2
+
+
+def synthetic_order_flow(num_orders:int, seed:int=0, mid_price:float=60000.0, tick_size:float=0.01,
+                         depth_ticks:int=500, cross_ratio:float=0.05, market_ratio:float=0.02, cancel_ratio:float=0.3) -> Dict[str, np.ndarray]:
+    """ Deterministic order flow against a book around a drifting mid price
+
+    Passive limit prices are a geometric number of ticks behind the touch, capped at depth_ticks, so most
+    of the volume sits near the top like a real book. A cross_ratio share of the limit orders cross the
+    spread, market_ratio of the flow are market orders and cancel_ratio are cancels of an earlier order.
+    Returns columns kind, side, price, quantity, order_id and target (the order a cancel refers to, or -1).
+    """
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice([LIMIT, MARKET, CANCEL], size=num_orders, p=[1 - market_ratio - cancel_ratio, market_ratio, cancel_ratio])
+    sides = rng.integers(0, 2, size=num_orders).astype(np.int8)
+    mid_ticks = np.round(mid_price / tick_size + np.cumsum(rng.normal(0, 0.05, size=num_orders))).astype(np.int64)
+    offsets = np.minimum(rng.geometric(0.05, size=num_orders), depth_ticks)
+    crossing = rng.random(num_orders) < cross_ratio
+    offsets[crossing] = -rng.integers(1, 5, size=crossing.sum())
+    # Buys (side 1) sit below the mid and sells above it, a negative offset crosses the spread
+    ticks = np.where(sides == 1, mid_ticks - offsets, mid_ticks + offsets)
+    quantities = np.round(rng.lognormal(-3, 1, size=num_orders), 5) + 0.00001
+    order_ids = np.arange(1, num_orders + 1, dtype=np.int64)
+    # Cancels target a random earlier order, which may already be filled or cancelled
+    targets = np.where(kinds == CANCEL, (rng.random(num_orders) * order_ids).astype(np.int64), -1)
+    return {
+        "kind": kinds,
+        "side": sides,
+        "price": ticks * tick_size,
+        "quantity": quantities,
+        "order_id": order_ids,
+        "target": targets,
+    }
+
+
+def synthetic_snapshots(num_rows:int, levels:int=10, seed:int=0, mid_price:float=60000.0, tick_size:float=0.01,
+                        start="2024-01-01 00:00:00+00:00", interval=pd.Timedelta(seconds=1)) -> pd.DataFrame:
+    """ Top-of-book snapshots in the format of the data/ CSV files, 2 * levels rows per timestamp """
+    rng = np.random.default_rng(seed)
+    rows_per_snapshot = 2 * levels
+    num_snapshots = max(num_rows // rows_per_snapshot, 1)
+    mid_ticks = np.round(mid_price / tick_size + np.cumsum(rng.normal(0, 2, size=num_snapshots))).astype(np.int64)
+    # Levels are one to three ticks apart, starting one tick from the mid on each side
+    gaps = rng.integers(1, 4, size=(num_snapshots, levels)).cumsum(axis=1)
+    ask_ticks = mid_ticks[:, None] + gaps
+    bid_ticks = mid_ticks[:, None] - gaps
+    prices = np.concatenate([ask_ticks, bid_ticks], axis=1) * tick_size
+    volumes = np.round(rng.lognormal(-2, 1, size=(num_snapshots, rows_per_snapshot)), 5) + 0.00001
+    sides = np.tile(np.array(["S"] * levels + ["B"] * levels), num_snapshots)
+    timestamps = pd.date_range(start, periods=num_snapshots, freq=interval)
+    return pd.DataFrame({
+        "side": sides,
+        "price": np.round(prices.ravel(), 2),
+        "volume": volumes.ravel(),
+        "qid": np.arange(num_snapshots * rows_per_snapshot, dtype=np.int64) + 100000000,
+        "internal_timestamp": np.repeat(timestamps.astype(str).to_numpy(), rows_per_snapshot),
+    })
@@ -0,0 +1,280 @@
+""" Benchmark suite for the order book, kernel, data oracle and analytics
+
+    python -m benchmarks.run_benchmarks --orders 1000000 --output results.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baselines/orders_1e5.json --fail-on-regression
+
+Every case runs on deterministic synthetic inputs (benchmarks.flows, SyntheticOracle) and reports a throughput,
+higher is better. Results are written as JSON and, given a baseline written by an earlier run, compared case by case.
+
+Baselines are kept in benchmarks/baselines, one file per order count (orders_1e5.json for --orders 100000), written
+with --repeat 3 --output on the versions pinned in requirements.txt (numpy 1.19.5, pandas 1.3.5, Python 3.8). The meta
+block records the machine and library versions: rates only compare on the same machine and libraries, so rewrite the
+baseline there before comparing, and commit it again when a change is meant to move a rate. --baseline refuses to
+compare runs of a different order count and warns when the library versions differ.
+"""
+from typing import Callable, Dict, List
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from agents.dummy_trader import DummyTrader
+from agents.exchange_agent import ExchangeAgent
+from benchmarks.flows import LIMIT, MARKET, synthetic_order_flow, synthetic_snapshots
+from kernel import Kernel
+from market_engine.data_oracle import DataOracle
+from market_engine.market_analytics import MarketAnalytics
+from market_engine.order import LimitOrder, MarketOrder
+from market_engine.order_book import OrderBook
+from market_engine.synthetic_oracle import SyntheticOracle
+from util.types import Side
+
+# Orders are built in chunks outside of the timed sections so that 1e7 orders do not need to fit in memory at once
+CHUNK_SIZE = 100000
+
+
+class _Sink:
+    """ Stands in for the exchange agent, drops the execution reports """
+    def send_message(self, recipient_id, message):
+        pass
+
+
+def _chunks(flow:Dict[str, np.ndarray]):
+    for start in range(0, len(flow["kind"]), CHUNK_SIZE):
+        yield {name: column[start:start + CHUNK_SIZE].tolist() for name, column in flow.items()}
+
+
+def _build_orders(chunk:Dict[str, List]) -> List:
+    orders = []
+    for kind, side, price, quantity, order_id, target in zip(chunk["kind"], chunk["side"], chunk["price"], chunk["quantity"],
+                                                           chunk["order_id"], chunk["target"]):
+        if kind == LIMIT:
+            orders.append(LimitOrder("bench", 0, "BTC", quantity, Side(side), price, order_id))
+        elif kind == MARKET:
+            orders.append(MarketOrder("bench", 0, "BTC", quantity, Side(side), order_id))
+        else:
+            orders.append(target)
+    return orders
+
+
+def bench_orderbook_insert(orders:int, seed:int) -> Dict:
+    """ Passive limit orders only, the book grows to every order of the flow """
+    flow = synthetic_order_flow(orders, seed, cross_ratio=0, market_ratio=0, cancel_ratio=0)
+    book = OrderBook("BTC", _Sink())
+    elapsed = 0.0
+    for chunk in _chunks(flow):
+        batch = _build_orders(chunk)
+        start = time.perf_counter()
+        for order in batch:
+            book.send_order(order)
+        elapsed += time.perf_counter() - start
+    return {"items": orders, "seconds": elapsed, "unit": "orders/s", "resting_orders": len(book._orders)}
+
+
+def bench_orderbook_mixed(orders:int, seed:int) -> Dict:
+    """ Limit, crossing, market and cancel orders mixed as in synthetic_order_flow """
+    flow = synthetic_order_flow(orders, seed)
+    book = OrderBook("BTC", _Sink())
+    elapsed = 0.0
+    for chunk in _chunks(flow):
+        batch = _build_orders(chunk)
+        start = time.perf_counter()
+        for order in batch:
+            if order.__class__ is int:
+                book.cancel_order(order)
+            else:
+                book.send_order(order)
+        elapsed += time.perf_counter() - start
+    return {"items": orders, "seconds": elapsed, "unit": "orders/s", "resting_orders": len(book._orders)}
+
+
+def bench_orderbook_cancel(orders:int, seed:int) -> Dict:
+    """ Cancel every order of a book of passive orders in random order, only the cancels are timed """
+    flow = synthetic_order_flow(orders, seed, cross_ratio=0, market_ratio=0, cancel_ratio=0)
+    book = OrderBook("BTC", _Sink())
+    for chunk in _chunks(flow):
+        for order in _build_orders(chunk):
+            book.send_order(order)
+    order_ids = np.random.default_rng(seed).permutation(flow["order_id"]).tolist()
+    start = time.perf_counter()
+    for order_id in order_ids:
+        book.cancel_order(order_id)
+    elapsed = time.perf_counter() - start
+    return {"items": orders, "seconds": elapsed, "unit": "cancels/s"}
+
+
+def bench_orderbook_wide(orders:int, seed:int) -> Dict:
+    """ Passive orders each on its own tick of a book about 4 * orders ticks wide, then cancelled in random order
+
+    Every insert and cancel adds or removes a level at a random depth, so this is the cost of the price ladders
+    when the book has as many levels as orders.
+    """
+    rng = np.random.default_rng(seed)
+    ticks = rng.choice(2 * orders, size=orders, replace=False) + 1
+    sides = rng.integers(0, 2, size=orders)
+    # bids below 2 * orders ticks and asks above, nothing crosses
+    ticks = np.where(sides == Side.BUY, ticks, ticks + 2 * orders)
+    book = OrderBook("BTC", _Sink(), tick_size=0.01)
+    elapsed = 0.0
+    for start in range(0, orders, CHUNK_SIZE):
+        batch = [LimitOrder("bench", 0, "BTC", 1.0, Side(side), tick / 100, order_id)
+                 for order_id, (side, tick) in enumerate(zip(sides[start:start + CHUNK_SIZE].tolist(), ticks[start:start + CHUNK_SIZE].tolist()), start)]
+        begin = time.perf_counter()
+        for order in batch:
+            book.send_order(order)
+        elapsed += time.perf_counter() - begin
+    order_ids = rng.permutation(orders).tolist()
+    begin = time.perf_counter()
+    for order_id in order_ids:
+        book.cancel_order(order_id)
+    elapsed += time.perf_counter() - begin
+    return {"items": 2 * orders, "seconds": elapsed, "unit": "ops/s", "levels": orders}
+
+
+def bench_oracle_read_data(orders:int, seed:int) -> Dict:
+    """ Parse a snapshot DataFrame of orders rows into the oracle's columns """
+    data = synthetic_snapshots(orders, seed=seed)
+    oracle = DataOracle(data, "BTC")
+    start = time.perf_counter()
+    oracle.read_data()
+    elapsed = time.perf_counter() - start
+    return {"items": len(data), "seconds": elapsed, "unit": "rows/s"}
+
+
+def bench_kernel_dummy_trader(orders:int, seed:int) -> Dict:
+    """ Full simulation of a DummyTrader on about orders synthetic events
+
+    The flow comes from a SyntheticOracle at 100 events per second, so the book depth stays bounded
+    however long the run is and the rate does not drift with the order count.
+    """
+    arrival_rate = 100.0
+    oracle = SyntheticOracle("BTC", duration=pd.Timedelta(seconds=orders / arrival_rate), seed=seed, arrival_rate=arrival_rate)
+    kernel = Kernel(instrument=True)
+    kernel.run(oracle, ExchangeAgent("exchange_agent", "BTC"), DummyTrader("dummy_agent"))
+    report = kernel.get_stats().report()
+    return {"items": report["events"], "seconds": report["wall_seconds"], "unit": "events/s",
+            "sim_seconds_per_wall_second": report["sim_seconds_per_wall_second"]}
+
+
+def _bench_analytics(orders:int, seed:int, indicators) -> Dict:
+    book = OrderBook("BTC", _Sink())
+    flow = synthetic_order_flow(min(orders, CHUNK_SIZE), seed, cross_ratio=0, market_ratio=0, cancel_ratio=0)
+    for chunk in _chunks(flow):
+        for order in _build_orders(chunk):
+            book.send_order(order)
+    analytics = MarketAnalytics("BTC", depth=5, indicators=indicators)
+    timestamps = pd.date_range("2024-01-01", periods=orders, freq="100ms", tz="UTC")
+    # Each update follows a change at the touch so that the depth view is refreshed as in a live run
+    elapsed = 0.0
+    for i, timestamp in enumerate(timestamps):
+        order = LimitOrder("bench", 0, "BTC", 0.01, Side.BUY if i % 2 else Side.SELL, book._best_bid() if i % 2 else book._best_ask())
+        book.send_order(order)
+        start = time.perf_counter()
+        analytics.update(timestamp, book)
+        elapsed += time.perf_counter() - start
+        book.cancel_order(order.order_id)
+    return {"items": orders, "seconds": elapsed, "unit": "updates/s"}
+
+
+def bench_analytics_update(orders:int, seed:int) -> Dict:
+    """ MarketAnalytics.update with the default indicators """
+    return _bench_analytics(orders, seed, None)
+
+
+def bench_analytics_update_no_indicators(orders:int, seed:int) -> Dict:
+    """ MarketAnalytics.update alone, the difference with analytics_update is the indicator cost """
+    return _bench_analytics(orders, seed, {})
+
+
+BENCHMARKS: Dict[str, Callable[[int, int], Dict]] = {
+    "orderbook_insert": bench_orderbook_insert,
+    "orderbook_mixed": bench_orderbook_mixed,
+    "orderbook_cancel": bench_orderbook_cancel,
+    "orderbook_wide": bench_orderbook_wide,
+    "oracle_read_data": bench_oracle_read_data,
+    "kernel_dummy_trader": bench_kernel_dummy_trader,
+    "analytics_update": bench_analytics_update,
+    "analytics_update_no_indicators": bench_analytics_update_no_indicators,
+}
+
+
+def run_benchmarks(names:List[str], orders:int, seed:int=0, repeat:int=1) -> Dict:
+    """ Run the named cases, keeping the fastest of repeat runs of each """
+    results = {}
+    for name in names:
+        runs = [BENCHMARKS[name](orders, seed) for _ in range(repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        best["rate"] = best["items"] / best["seconds"] if best["seconds"] else None
+        results[name] = best
+    return {
+        "meta": {
+            "orders": orders,
+            "seed": seed,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "date": pd.Timestamp.now(tz="UTC").isoformat(),
+        },
+        "results": results,
+    }
+
+
+def compare(results:Dict, baseline:Dict, tolerance:float=0.1) -> Dict[str, Dict]:
+    """ Rate of each case relative to the baseline, flagged slower/faster beyond tolerance """
+    comparison = {}
+    for name, result in results["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or not reference.get("rate") or result["rate"] is None:
+            continue
+        ratio = result["rate"] / reference["rate"]
+        status = "slower" if ratio < 1 - tolerance else "faster" if ratio > 1 + tolerance else "same"
+        comparison[name] = {"rate": result["rate"], "baseline_rate": reference["rate"], "ratio": ratio, "status": status}
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the order book, kernel, oracle and analytics")
+    parser.add_argument("--orders", type=float, default=1e5, help="orders, rows or updates per case (1e5 to 1e7)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--only", nargs="*", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change below which a case counts as the same")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if a case is slower than the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.only, int(args.orders), args.seed, args.repeat)
+    for name, result in results["results"].items():
+        print(f"{name:32s} {result['rate']:14,.0f} {result['unit']:10s} ({result['items']} in {result['seconds']:.3f}s)")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["meta"]["orders"] != results["meta"]["orders"]:
+            # rates depend on the book size, so cases of different sizes do not compare
+            print(f"Not compared: the baseline ran {baseline['meta']['orders']} orders per case, this run {results['meta']['orders']}")
+            return 2
+        for library in ("python", "numpy", "pandas"):
+            if baseline["meta"].get(library) != results["meta"][library]:
+                print(f"Warning: the baseline ran {library} {baseline['meta'].get(library)}, this run {results['meta'][library]}")
+        comparison = compare(results, baseline, args.tolerance)
+        for name, change in comparison.items():
+            print(f"{name:32s} x{change['ratio']:.2f} vs baseline ({change['status']})")
+        if args.fail_on_regression and any(change["status"] == "slower" for change in comparison.values()):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
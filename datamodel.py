@@ -0,0 +1,86 @@
+""" Trading state interface the strategies of trader.py are written against
+
+A TradingState is what a strategy's run(state) sees at each iteration: the order depth of every
+product, its own trades since the last iteration, its positions and the traderData string it
+returned last time. run returns the orders to send per product, a new traderData and a conversion
+request (ignored by this simulator). Sell volumes of an OrderDepth are negative, like sell order
+quantities.
+"""
+from typing import Dict, List
+import json
+
+Time = int
+Symbol = str
+Product = str
+Position = float
+UserId = str
+
+
+class Listing:
+    def __init__(self, symbol:Symbol, product:Product, denomination:Product):
+        self.symbol = symbol
+        self.product = product
+        self.denomination = denomination
+
+
+class Observation:
+    def __init__(self, plainValueObservations:Dict[Product, float]=None, conversionObservations:Dict[Product, object]=None):
+        self.plainValueObservations = plainValueObservations or {}
+        self.conversionObservations = conversionObservations or {}
+
+    def __str__(self):
+        return f"(plainValueObservations: {self.plainValueObservations}, conversionObservations: {self.conversionObservations})"
+
+
+class Order:
+    def __init__(self, symbol:Symbol, price:float, quantity:float):
+        """ Limit order of a strategy, a positive quantity buys and a negative one sells """
+        self.symbol = symbol
+        self.price = price
+        self.quantity = quantity
+
+    def __str__(self):
+        return f"({self.symbol}, {self.price}, {self.quantity})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class OrderDepth:
+    def __init__(self, buy_orders:Dict[float, float]=None, sell_orders:Dict[float, float]=None):
+        """ price -> volume of the book levels, bids best (highest) first and asks best (lowest) first with negative volumes """
+        self.buy_orders: Dict[float, float] = buy_orders if buy_orders is not None else {}
+        self.sell_orders: Dict[float, float] = sell_orders if sell_orders is not None else {}
+
+
+class Trade:
+    def __init__(self, symbol:Symbol, price:float, quantity:float, buyer:UserId=None, seller:UserId=None, timestamp:Time=0):
+        self.symbol = symbol
+        self.price = price
+        self.quantity = quantity
+        self.buyer = buyer
+        self.seller = seller
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return f"({self.symbol}, {self.buyer} << {self.seller}, {self.price}, {self.quantity}, {self.timestamp})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class TradingState:
+    def __init__(self, traderData:str, timestamp:Time, listings:Dict[Symbol, Listing], order_depths:Dict[Symbol, OrderDepth],
+                 own_trades:Dict[Symbol, List[Trade]], market_trades:Dict[Symbol, List[Trade]], position:Dict[Product, Position],
+                 observations:Observation):
+        self.traderData = traderData
+        self.timestamp = timestamp
+        self.listings = listings
+        self.order_depths = order_depths
+        self.own_trades = own_trades
+        self.market_trades = market_trades
+        self.position = position
+        self.observations = observations
+
+    def toJSON(self):
+        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True)
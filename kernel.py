@@ -1,28 +1,68 @@
-from typing import List
-import queue
+from typing import Dict, Iterator, List, Optional
+import copy
+import multiprocessing
 import random
+import time
+import numpy as np
 import pandas as pd
 
 from market_engine.data_oracle import DataOracle
+from market_engine.order import Order
+from util.event_calendar import EventCalendar, Timer
+from util.instrumentation import KernelStats
 from util.message import Message
+from util.journal import Journal
 from util.logger import setup_logger, DummyLogger
 from util.message import MessageType
 
+# Read-only episode inputs shared by the workers of a parallel train, set once per worker process
+_episode_template = None
+
+
+def _init_episode_worker(oracle, exchange_agent, trading_agent):
+    global _episode_template
+    _episode_template = (oracle, exchange_agent, trading_agent)
+
+
+def _run_episode(args):
+    episode, seed = args
+    oracle, exchange_agent, trading_agent = _episode_template
+    random.seed(seed)
+    np.random.seed(seed)
+    # Each episode gets fresh agents, the oracle data is shared by every episode of the worker
+    exchange_agent, trading_agent = copy.deepcopy((exchange_agent, trading_agent), {id(oracle): oracle})
+    kernel = Kernel()
+    kernel.run(oracle, exchange_agent, trading_agent)
+    return {"episode": episode, "seed": seed, **trading_agent.get_results()}
+
+
+# Kernel and rollout function that forked rollout workers inherit
+_fork_source = None
+
+
+def _run_forked_rollout(seed):
+    kernel, rollout = _fork_source
+    random.seed(seed)
+    np.random.seed(seed)
+    return rollout(kernel)
+
+
 class Kernel:
-    def __init__(self, log_name = None):
+    def __init__(self, log_name = None, journal:Journal=None, instrument:bool=False, stats_file:str=None):
         self._logger = setup_logger(log_name) if log_name else DummyLogger()
+        # Structured event records, every category is disabled unless a journal is given
+        self._journal = journal if journal is not None else Journal()
+        # Handler timings and queue depth, exported to stats_file at the end of each run if given
+        self._stats = KernelStats() if instrument or stats_file else None
+        self._stats_file = stats_file
         self._logger.info("-"*50)
         self._logger.info("Kernel initialized")
         self._pre_run = False
         self._last_state = None
         
-        # About time
-        self._analytics_interval = pd.Timedelta(seconds=0.1) 
-        self._data_request_interval = pd.Timedelta(seconds=0.1)
-        self._agent_activation_interval = pd.Timedelta(seconds=0.5)
-        
         # Agent registry
         self._agents = {}
+        self._flush_agents = []
     
     def register_agent(self, agent):
         if agent.id not in self._agents:
@@ -34,8 +74,13 @@ class Kernel:
         self._logger.info("Kernel reset")    
         
     def pre_run(self, oracle, exchange_agent, trading_agent, load_last_state=False):
+        if load_last_state and self._last_state is not None:
+            self.restore_state(self._last_state)
+            self._pre_run = True
+            return
+        
         # Init Loop Message
-        self._messages = queue.PriorityQueue()
+        self._messages = EventCalendar()
         
         # Initialize data oracle that feed market data
         self._oracle = oracle
@@ -49,78 +94,321 @@ class Kernel:
         # Init Exchange Agent
         self._exchange_agent = exchange_agent
         self._exchange_agent.kernel_init(self, self._logger)
+        self._exchange_agent.kernel_start(self._start_time)
         self.register_agent(self._exchange_agent)
-        self._next_analytics_time = self._start_time
         self._logger.info(f"Exchange agent {self._exchange_agent.id} initialized")
         
-        # Pre-send orders
+        # Schedule the first orders, or the first window of them when streaming
         self._oracle.kernel_start(self._start_time)
-        self._logger.info(f"Oracle started and pre-sent orders")
+        self._logger.info(f"Oracle started (streaming: {self._oracle.streaming})")
         
         # Init Trading Agent
         self._trading_agent = trading_agent
         self._trading_agent.kernel_init(self, self._logger)
         self._trading_agent.kernel_start(self._start_time)
-        self._next_data_request_time = self._start_time
-        self._next_agent_activation_time = self._start_time
         self.register_agent(self._trading_agent)
         self._logger.info(f"Trading agent {self._trading_agent.id} initialized")
         
+        self._flush_agents = [agent for agent in self._agents.values() if agent.needs_slice_flush]
         self._pre_run = True
     
-    def train(self, oracle, exchange_agent, trading_agent, num_episodes=1):
+    def train(self, oracle, exchange_agent, trading_agent, num_episodes=1, num_workers=1, seed=None) -> List[Dict]:
+        """ Run num_episodes episodes and return the trading agent results of each one
+
+        Every episode runs on fresh copies of the agents with its own seed, so that an episode's
+        results do not depend on the ones before it. With num_workers > 1 the episodes are spread
+        over a process pool and the oracle is handed to each worker once (shared copy-on-write
+        where processes are forked) instead of once per episode.
+        """
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_episodes)]
+        if num_workers > 1:
+            self._logger.info(f"Starting {num_episodes} episodes on {num_workers} workers")
+            if "fork" in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context("fork")
+            else:
+                context = multiprocessing.get_context()
+            with context.Pool(num_workers, _init_episode_worker, (oracle, exchange_agent, trading_agent)) as pool:
+                results = pool.map(_run_episode, list(enumerate(seeds)))
+            self._logger.info(f"Training completed")
+            return results
+        
+        results = []
         for episode in range(num_episodes):
             self._logger.info(f"Starting episode {episode+1}")
-            self.run(oracle, exchange_agent, trading_agent)
+            random.seed(seeds[episode])
+            np.random.seed(seeds[episode])
+            episode_exchange, episode_trader = copy.deepcopy((exchange_agent, trading_agent), {id(oracle): oracle})
+            self.reset()
+            self.run(oracle, episode_exchange, episode_trader)
+            results.append({"episode": episode, "seed": seeds[episode], **episode_trader.get_results()})
             self._logger.info(f"Finished episode {episode+1}")
         self._logger.info(f"Training completed")
+        return results
         
     def run(self, oracle, exchange_agent, trading_agent, load_last_state=False):
         self.pre_run(oracle, exchange_agent, trading_agent, load_last_state)
-        
-        # Main loop
-        while self._current_time <= self._end_time:
-            self.process_messages()
-            # This part to be improved to have autonomous agents
-            if self._current_time >= self._next_analytics_time:
-                self._exchange_agent.update_market_analytics()
-                self._next_analytics_time += self._analytics_interval
-            if self._current_time >= self._next_data_request_time:
-                self._trading_agent.request_market_data()
-                self._next_data_request_time += self._data_request_interval
-            if self._current_time >= self._next_agent_activation_time:
-                self._trading_agent.request_wake_up()
-                self._next_agent_activation_time += self._agent_activation_interval
-            self.advance_time()
-        
-    def process_messages(self):
-        while not self._messages.empty():
-            message_time, (recipient, message_type, message) = self._messages.get()
-            if message_time <= self._current_time:
-                #self._logger.debug(f"Processing message for {recipient} at {self._current_time}: {message}")
-                self._agents[recipient].receive_message(self._current_time, message)
+        self.resume()
+        self.stop()
+        self._journal.flush()
+        if self._stats is not None:
+            self._logger.info("%s", self._stats)
+            if self._stats_file:
+                self._stats.export(self._stats_file)
+    
+    def resume(self, end_time=None):
+        """ Carry on the main loop from the current state up to end_time (default the oracle end time) """
+        end_time = self._end_time if end_time is None else min(end_time, self._end_time)
+        # The clock never goes back
+        end_time = max(end_time, self._current_time)
+        stats = self._stats
+        if stats is not None:
+            stats.start(self._current_time)
+        # Main loop, the clock jumps straight to the next scheduled event
+        next_time = self._messages.peek_time()
+        while next_time is not None and next_time <= end_time:
+            self._current_time = next_time
+            if stats is None:
+                self.process_messages()
             else:
-                #self._logger.debug(f"Reinserting message for {recipient} scheduled at {message_time} back into queue")
-                self._messages.put((message_time, (recipient, message_type, message)))
-                break
-    
-    def advance_time(self):
-        #self._logger.debug(f"Advancing time from {self._current_time}")
-        #self._logger.debug(f"Status of queue: full? {self._messages.full()}, empty? {self._messages.empty()}, size? {self._messages.qsize()}, maxsize? {self._messages.maxsize}")
-        if not self._messages.empty():
-            next_message_time = self._messages.queue[0][0]
-            self._current_time = min(next_message_time, self._end_time)
-            #self._logger.debug(f"Advanced time to {self._current_time}")
-        else:
-            self._current_time += pd.Timedelta(seconds=0.01)
-            #self._logger.debug(f"Advanced time to {self._current_time} due to no pending messages")
+                stats.sample_queue(next_time, len(self._messages))
+                self._process_messages_instrumented(stats)
+            next_time = self._messages.peek_time()
+        self._current_time = end_time
+        if stats is not None:
+            stats.stop(end_time)
+    
+    def stop(self):
+        """ Call kernel_stop on every agent, which also shuts down the exchange's shard processes
+
+        run stops the agents at its end, step-wise drivers call stop once they are done with the simulation.
+        """
+        for agent in self._agents.values():
+            agent.kernel_stop()
+    
+    # Step-wise methods, for drivers that advance the simulation a little at a time and inspect it in between
+    def step_until(self, end_time) -> bool:
+        """ Process every event up to end_time (clipped to the oracle end time) and stop there, False once the run is over
+
+        State is kept between calls, so thousands of short steps cost no more than one resume over the same span.
+        """
+        self.resume(end_time)
+        return not self.done
+    
+    def run_for(self, duration) -> bool:
+        """ step_until the current time plus duration """
+        return self.step_until(self._current_time + duration)
+    
+    def run_events(self, num_events:int) -> int:
+        """ Process time slices until at least num_events messages and timers were delivered or the run is over
+
+        A time slice is never split, so the count returned may exceed num_events. The clock stays at the
+        last processed slice.
+        """
+        delivered = 0
+        stats = self._stats
+        if stats is not None:
+            stats.start(self._current_time)
+        next_time = self._messages.peek_time()
+        while delivered < num_events and next_time is not None and next_time <= self._end_time:
+            delivered += self._process_slice(next_time, stats)
+            next_time = self._messages.peek_time()
+        if stats is not None:
+            stats.stop(self._current_time)
+        return delivered
+    
+    def slices(self, end_time=None) -> Iterator[pd.Timestamp]:
+        """ Generator processing one time slice per iteration up to end_time (default the oracle end time)
+
+        Yields the time of each processed slice, the caller can inspect the agents or send messages before
+        asking for the next one. The clock ends at end_time once the generator is exhausted.
+        """
+        end_time = self._end_time if end_time is None else min(end_time, self._end_time)
+        stats = self._stats
+        next_time = self._messages.peek_time()
+        while next_time is not None and next_time <= end_time:
+            if stats is not None:
+                stats.start(self._current_time)
+                self._process_slice(next_time, stats)
+                stats.stop(self._current_time)
+            else:
+                self._current_time = next_time
+                self.process_messages()
+            yield next_time
+            next_time = self._messages.peek_time()
+        self._current_time = max(self._current_time, end_time)
+    
+    @property
+    def done(self) -> bool:
+        """ True once no event is left before the oracle end time """
+        next_time = self._messages.peek_time()
+        return next_time is None or next_time > self._end_time
+    
+    def _process_slice(self, slice_time, stats:Optional[KernelStats]) -> int:
+        self._current_time = slice_time
+        if stats is None:
+            return self.process_messages()
+        stats.sample_queue(slice_time, len(self._messages))
+        return self._process_messages_instrumented(stats)
+        
+    def process_messages(self) -> int:
+        """ Deliver everything due at the current time, returns the number of messages and timers delivered """
+        # Messages sent with no delay while handling a batch are due now as well
+        delivered = 0
+        due = self._messages.pop_due(self._current_time)
+        while due:
+            delivered += len(due)
+            for recipient, message in due:
+                if recipient is None:
+                    self._fire_timer(message)
+                else:
+                    self._agents[recipient].receive_message(self._current_time, message)
+            due = self._messages.pop_due(self._current_time)
+            if not due and self._flush_agents:
+                due = self._flush_slice()
+        return delivered
+    
+    def _flush_slice(self):
+        """ End of the time slice for the agents that batch their work, returns what they made due now """
+        for agent in self._flush_agents:
+            agent.flush_slice(self._current_time)
+        return self._messages.pop_due(self._current_time)
+    
+    def _process_messages_instrumented(self, stats:KernelStats):
+        """ process_messages timing every handler, kept apart so that the plain loop pays nothing """
+        clock = time.perf_counter_ns
+        delivered = 0
+        due = self._messages.pop_due(self._current_time)
+        while due:
+            delivered += len(due)
+            for recipient, message in due:
+                if recipient is None:
+                    start = clock()
+                    self._fire_timer(message)
+                    callback = message.callback
+                    owner = getattr(callback, "__self__", None)
+                    agent = getattr(owner, "id", type(owner).__name__) if owner is not None else "kernel"
+                    stats.record(agent, f"TIMER {getattr(callback, '__name__', 'callback')}", clock() - start)
+                else:
+                    start = clock()
+                    self._agents[recipient].receive_message(self._current_time, message)
+                    stats.record(recipient, message.type.name, clock() - start)
+            due = self._messages.pop_due(self._current_time)
+            if not due and self._flush_agents:
+                start = clock()
+                due = self._flush_slice()
+                stats.record("kernel", "FLUSH_SLICE", clock() - start)
+        return delivered
+    
+    def get_stats(self) -> Optional[KernelStats]:
+        return self._stats
+    
+    # Timer methods
+    def schedule_timer(self, callback, interval=None, start_time=None):
+        """ Call callback(current_time) at start_time (default now), then every interval if one is given """
+        timer = Timer(callback, interval)
+        self._messages.push(start_time if start_time is not None else self._current_time, None, timer)
+        return timer
+    
+    def _fire_timer(self, timer:Timer):
+        if not timer.active:
+            return
+        timer.callback(self._current_time)
+        if timer.interval is not None and timer.active:
+            self._messages.push(self._current_time + timer.interval, None, timer)
               
+    # Checkpoint methods
+    def save_state(self):
+        """ Snapshot the calendar, agents (order book and analytics included), clock and random state
+
+        The snapshot is also kept as the last state, which pre_run/run reload with load_last_state=True.
+        """
+        # The kernel, oracle data, logger and journal are shared rather than copied
+        memo = {id(self): self, id(self._oracle): self._oracle, id(self._logger): self._logger, id(self._journal): self._journal}
+        messages, agents = copy.deepcopy((self._messages, self._agents), memo)
+        self._last_state = {
+            "messages": messages,
+            "agents": agents,
+            "exchange_id": self._exchange_agent.id,
+            "trading_id": self._trading_agent.id,
+            "current_time": self._current_time,
+            "oracle_state": self._oracle.get_state(),
+            "random_state": random.getstate(),
+            "np_random_state": np.random.get_state(),
+            "message_id": Message.message_id,
+            "order_id": Order.last_order_id,
+        }
+        return self._last_state
+    
+    def restore_state(self, state):
+        """ Restore a snapshot taken by save_state, which stays untouched and can be restored again """
+        memo = {id(self): self, id(self._oracle): self._oracle, id(self._logger): self._logger, id(self._journal): self._journal}
+        self._messages, self._agents = copy.deepcopy((state["messages"], state["agents"]), memo)
+        self._exchange_agent = self._agents[state["exchange_id"]]
+        self._trading_agent = self._agents[state["trading_id"]]
+        self._flush_agents = [agent for agent in self._agents.values() if agent.needs_slice_flush]
+        self._current_time = state["current_time"]
+        # The oracle may have been bound to another kernel since the snapshot
+        self._oracle.kernel_init(self)
+        self._oracle.set_state(state["oracle_state"])
+        random.setstate(state["random_state"])
+        np.random.set_state(state["np_random_state"])
+        Message.message_id = state["message_id"]
+        Order.last_order_id = state["order_id"]
+    
+    def fork_rollouts(self, rollout=None, num_rollouts=1, num_workers=None, seed=None) -> List:
+        """ Branch num_rollouts what-if runs from the current state and return rollout(kernel) of each
+
+        Every rollout runs in a freshly forked process that inherits the kernel copy-on-write, so
+        nothing is re-simulated or pickled. The default rollout resumes to the end and returns the
+        trading agent results. Without fork the rollouts run one after another from a snapshot. A sharded
+        exchange takes its books back first, each rollout then matches them in its own process.
+        """
+        global _fork_source
+        rollout = rollout or Kernel._resume_to_end
+        seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_rollouts)]
+        if "fork" not in multiprocessing.get_all_start_methods():
+            state = self.save_state()
+            results = []
+            for rollout_seed in seeds:
+                self.restore_state(state)
+                random.seed(rollout_seed)
+                np.random.seed(rollout_seed)
+                results.append(rollout(self))
+            self.restore_state(state)
+            return results
+        
+        # The rollouts must not share the worker processes of the agents (the exchange's shards)
+        for agent in self._agents.values():
+            agent.release_workers()
+        _fork_source = (self, rollout)
+        try:
+            # One task per worker process so every rollout starts from the untouched parent state
+            with multiprocessing.get_context("fork").Pool(num_workers or num_rollouts, maxtasksperchild=1) as pool:
+                return pool.map(_run_forked_rollout, seeds, chunksize=1)
+        finally:
+            _fork_source = None
+    
+    def _resume_to_end(self):
+        self.resume()
+        return self._trading_agent.get_results()
+    
+    def get_agent(self, agent_id):
+        return self._agents[agent_id]
+    
     # Communication methods
     def send_message(self, sender:str, recipient:str, message:Message, delay=pd.Timedelta(seconds=0)):
         deliver_time = self._current_time + delay
-        self._messages.put((deliver_time, (recipient, message.type, message)))
+        self._messages.push(deliver_time, recipient, message)
+    
+    def get_journal(self) -> Journal:
+        return self._journal
     
     def get_exchange_id(self):
         return self._exchange_agent.id
+    
+    def get_current_time(self):
+        return self._current_time
+    
+    def get_end_time(self):
+        return self._end_time
         
-
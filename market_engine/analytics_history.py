@@ -0,0 +1,69 @@
+from typing import Optional
+import numpy as np
+import pandas as pd
+
+
+class AnalyticsHistory:
+    """ Fixed-capacity history of book snapshots stored in NumPy arrays
+
+    Every row is written twice, at position i and i + capacity of buffers twice the capacity long,
+    so that any window of up to capacity consecutive rows is a contiguous slice. Appends are O(depth)
+    and windows are views, memory does not grow past capacity rows. Missing levels have a NaN price
+    and a zero volume, a missing mid price is NaN.
+    """
+
+    def __init__(self, capacity:int, depth:int):
+        self.capacity = capacity
+        self.depth = depth
+        self.version = 0  # number of rows ever appended
+        self._tz = None
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.mid_prices = np.full(2 * capacity, np.nan)
+        self.bid_prices = np.full((2 * capacity, depth), np.nan)
+        self.bid_volumes = np.zeros((2 * capacity, depth))
+        self.ask_prices = np.full((2 * capacity, depth), np.nan)
+        self.ask_volumes = np.zeros((2 * capacity, depth))
+
+    def __len__(self):
+        return min(self.version, self.capacity)
+
+    def append(self, timestamp:pd.Timestamp, mid_price:Optional[float], bids:np.ndarray, asks:np.ndarray):
+        """ Append one snapshot, bids and asks are (levels, 2+) arrays of price and volume, best first """
+        if self._tz is None:
+            self._tz = timestamp.tz
+        position = self.version % self.capacity
+        for row in (position, position + self.capacity):
+            self.timestamps[row] = timestamp.value
+            self.mid_prices[row] = mid_price if mid_price is not None else np.nan
+            self._write_levels(self.bid_prices[row], self.bid_volumes[row], bids)
+            self._write_levels(self.ask_prices[row], self.ask_volumes[row], asks)
+        self.version += 1
+
+    def _write_levels(self, prices:np.ndarray, volumes:np.ndarray, levels:np.ndarray):
+        count = min(len(levels), self.depth)
+        prices[:count] = levels[:count, 0]
+        prices[count:] = np.nan
+        volumes[:count] = levels[:count, 1]
+        volumes[count:] = 0
+
+    def oldest_version(self) -> int:
+        return max(self.version - self.capacity, 0)
+
+    def window(self, length:int, end_version:Optional[int]=None) -> slice:
+        """ Buffer slice holding the rows [end_version - length, end_version), clipped to what is retained """
+        end_version = self.version if end_version is None else end_version
+        if end_version > self.version or end_version < self.oldest_version():
+            raise IndexError(f"Version {end_version} is not retained (retained: {self.oldest_version()} to {self.version})")
+        start_version = max(end_version - length, self.oldest_version())
+        start = start_version % self.capacity if self.capacity else 0
+        return slice(start, start + end_version - start_version)
+
+    def row(self, version:int) -> int:
+        """ Buffer position of a retained row """
+        if not self.oldest_version() <= version < self.version:
+            raise IndexError(f"Version {version} is not retained (retained: {self.oldest_version()} to {self.version})")
+        return version % self.capacity
+
+    def to_timestamp(self, value:int) -> pd.Timestamp:
+        timestamp = pd.Timestamp(int(value))
+        return timestamp.tz_localize('UTC').tz_convert(self._tz) if self._tz is not None else timestamp
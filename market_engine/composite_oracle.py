@@ -0,0 +1,39 @@
+from typing import List
+
+
+class CompositeOracle:
+    """ Several oracles feeding one kernel, typically one per symbol of a multi-symbol exchange
+
+    Each oracle schedules its own orders (and streams them if it streams), the run covers the union
+    of their time ranges.
+    """
+
+    def __init__(self, oracles:List):
+        self.oracles = list(oracles)
+
+    @property
+    def streaming(self):
+        return any(oracle.streaming for oracle in self.oracles)
+
+    def get_start_time(self):
+        return min(oracle.get_start_time() for oracle in self.oracles)
+
+    def get_end_time(self):
+        return max(oracle.get_end_time() for oracle in self.oracles)
+
+    def get_state(self):
+        return [oracle.get_state() for oracle in self.oracles]
+
+    def set_state(self, state):
+        for oracle, oracle_state in zip(self.oracles, state):
+            oracle.set_state(oracle_state)
+
+    def kernel_init(self, kernel):
+        self.kernel = kernel
+        for oracle in self.oracles:
+            oracle.kernel_init(kernel)
+
+    def kernel_start(self, start_time):
+        self.start_time = start_time
+        for oracle in self.oracles:
+            oracle.kernel_start(start_time)
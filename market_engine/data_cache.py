@@ -0,0 +1,85 @@
+from typing import Dict
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from market_engine.data_oracle import read_columns
+
+
+class MarketDataCache:
+    """ On-disk cache of parsed market data, memory-mapped on later runs
+
+    Each source file is converted once into int64 nanosecond timestamps with their row offsets,
+    int8 sides, tick-scaled prices, lot-scaled volumes and qids, stored as .npy files in a
+    directory named after the source file, a hash of its absolute path and its content hash, so that
+    files of the same name in different directories get their own entries.
+    """
+    COLUMNS = ['timestamps', 'offsets', 'sides', 'prices', 'volumes', 'qids']
+
+    def __init__(self, cache_dir:str='cache', price_decimals:int=2, volume_decimals:int=8):
+        self.cache_dir = cache_dir
+        self.price_scale = 10 ** price_decimals
+        self.volume_scale = 10 ** volume_decimals
+
+    def load(self, path:str) -> Dict:
+        """ Return the columns of a source file, building the cache entry first if it is missing or stale """
+        source_hash = self.file_hash(path)
+        entry = self._entry_path(path, source_hash)
+        if not os.path.exists(os.path.join(entry, 'meta.json')):
+            self._build(path, source_hash)
+        with open(os.path.join(entry, 'meta.json')) as f:
+            columns = json.load(f)
+        for name in self.COLUMNS:
+            columns[name] = np.load(os.path.join(entry, f"{name}.npy"), mmap_mode='r')
+        return columns
+
+    @staticmethod
+    def file_hash(path:str, chunk_size:int=1 << 20) -> str:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _entry_prefix(path:str) -> str:
+        path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+        return f"{os.path.basename(path)}.{path_hash}."
+
+    def _entry_path(self, path:str, source_hash:str) -> str:
+        return os.path.join(self.cache_dir, f"{self._entry_prefix(path)}{source_hash[:16]}")
+
+    def _build(self, path:str, source_hash:str):
+        columns = read_columns(pd.read_csv(path))
+        columns['prices'] = np.rint(columns['prices'] * self.price_scale).astype(np.int64)
+        columns['volumes'] = np.rint(columns['volumes'] * self.volume_scale).astype(np.int64)
+        columns['price_scale'] = self.price_scale
+        columns['volume_scale'] = self.volume_scale
+        columns['source_hash'] = source_hash
+
+        # Write into a scratch directory and rename it so concurrent runs never see a partial entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        scratch = tempfile.mkdtemp(dir=self.cache_dir)
+        for name in self.COLUMNS:
+            np.save(os.path.join(scratch, f"{name}.npy"), columns.pop(name))
+        with open(os.path.join(scratch, 'meta.json'), 'w') as f:
+            json.dump(columns, f)
+        try:
+            os.rename(scratch, self._entry_path(path, source_hash))
+        except OSError:
+            # Another run renamed in the same entry first
+            shutil.rmtree(scratch, ignore_errors=True)
+        self._remove_stale(path, source_hash)
+
+    def _remove_stale(self, path:str, source_hash:str):
+        """ Delete the entries of other versions of the same source path, never the current one """
+        prefix = self._entry_prefix(path)
+        current = os.path.basename(self._entry_path(path, source_hash))
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name != current:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
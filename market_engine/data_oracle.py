@@ -1,41 +1,176 @@
-from collections import defaultdict
 from market_engine.order import LimitOrder
 from util.types import Side, MessageType
 from util.message import Message
 
+import copy
+import numpy as np
 import pandas as pd
 import random
 
+def read_columns(data:pd.DataFrame):
+    """ Parse a top-of-book DataFrame into columnar arrays grouped by timestamp """
+    timestamps = pd.to_datetime(data['internal_timestamp'])
+    timestamps_ns = timestamps.values.astype('datetime64[ns]').view(np.int64)
+    # One stable sort then group rows by timestamp offsets
+    sort = np.argsort(timestamps_ns, kind='stable')
+    unique_ns, starts = np.unique(timestamps_ns[sort], return_index=True)
+    side_codes, side_names = pd.factorize(data['side'].values[sort])
+    return {
+        'timestamps': unique_ns,
+        'offsets': np.append(starts, len(sort)),
+        'sides': np.array([Side[name] for name in side_names], dtype=np.int8)[side_codes],
+        'prices': np.ascontiguousarray(data['price'].values[sort], dtype=np.float64),
+        'volumes': np.ascontiguousarray(data['volume'].values[sort], dtype=np.float64),
+        'qids': np.ascontiguousarray(data['qid'].values[sort], dtype=np.int64),
+        'price_scale': 1,
+        'volume_scale': 1,
+        'tz': str(timestamps.dt.tz) if timestamps.dt.tz is not None else None,
+    }
+
+
 class DataOracle:
-    def __init__(self, data:pd.DataFrame, symbol:str, random_seed=7):
+    def __init__(self, data:pd.DataFrame, symbol:str, random_seed=7, streaming=False, stream_window=pd.Timedelta(seconds=1), replay="snapshot"):
         self.data = data
         self.symbol = symbol
-        self._orders = defaultdict(list)
         self._timestamps = None
+        # Columnar order data sorted by timestamp, orders of the i-th timestamp are rows offsets[i]:offsets[i+1]
+        self._offsets = None
+        self._sides = None
+        self._prices = None
+        self._volumes = None
+        self._qids = None
+        # Prices and volumes may be stored as integer ticks and lots
+        self._price_scale = 1
+        self._volume_scale = 1
+        # Streaming mode only keeps one window of future orders in the kernel queue, otherwise the orders of
+        # each timestamp are built and sent when it comes up
+        self.streaming = streaming
+        self._stream_window = stream_window
+        self._cursor = 0
+        # "snapshot" sends every row as a new order, "diff" only sends the changes between consecutive snapshots
+        if replay not in ("snapshot", "diff"):
+            raise ValueError(f"Unknown replay mode: {replay}")
+        self.replay = replay
+        # Diff mode view of the oracle's resting liquidity: (side, price) -> [total volume, [[order_id, volume], ...]]
+        self._replay_levels = {}
+        # Diff mode delivery time of the last snapshot, later snapshots are never delivered before it
+        self._last_delivery = None
+    
+    @classmethod
+    def from_cache(cls, cache, path:str, symbol:str, **kwargs):
+        """ Build an oracle on the memory-mapped columns of a MarketDataCache instead of a DataFrame """
+        oracle = cls(None, symbol, **kwargs)
+        oracle.load_columns(cache.load(path))
+        return oracle
     
     def read_data(self):
-        self.data['internal_timestamp'] = pd.to_datetime(self.data['internal_timestamp'])
-        self._timestamps = self.data['internal_timestamp'].unique()
-        for timestamp in self._timestamps:
-            orders_at = self.data[self.data['internal_timestamp'] == timestamp ]
-            for index, line in orders_at.iterrows():
-                side = Side[line['side']]
-                price = line['price']
-                volume = line['volume']
-                id = line['qid']
-                order = LimitOrder("Market", timestamp, self.symbol, volume, side, price, id)
-                self._orders[timestamp].append(order)
+        self.load_columns(read_columns(self.data))
+    
+    def load_columns(self, columns):
+        timestamps = pd.to_datetime(columns['timestamps'], utc=True)
+        self._timestamps = timestamps.tz_convert(columns['tz']) if columns['tz'] else timestamps.tz_localize(None)
+        self._offsets = columns['offsets']
+        self._sides = columns['sides']
+        self._prices = columns['prices']
+        self._volumes = columns['volumes']
+        self._qids = columns['qids']
+        self._price_scale = columns['price_scale']
+        self._volume_scale = columns['volume_scale']
     
     def pre_send_orders(self):
-        for timestamp in self._timestamps:
-            orders = self.get_orders(timestamp)
-            for order in orders:
-                noise_seconds = random.uniform(0, 1)
-                noise_delay = pd.Timedelta(seconds=noise_seconds).round("10ms")
-                self.kernel.send_message("", self.kernel.get_exchange_id(), Message(MessageType.LIMIT_ORDER, order), noise_delay)
+        """ Schedule the delivery event of the first timestamp, orders are only built when their timestamp comes up """
+        self._cursor = 0
+        if len(self._timestamps):
+            self.kernel.schedule_timer(self.deliver_orders, start_time=self._timestamps[0])
+    
+    def deliver_orders(self, current_time):
+        """ Send the orders of the timestamp due now and schedule the delivery event of the next one """
+        self.send_orders(self._cursor)
+        self._cursor += 1
+        if self._cursor < len(self._timestamps):
+            self.kernel.schedule_timer(self.deliver_orders, start_time=self._timestamps[self._cursor])
+    
+    def send_orders(self, index):
+        """ Schedule the orders of the index-th timestamp for delivery at that timestamp plus some noise """
+        timestamp = self._timestamps[index]
+        exchange_id = self.kernel.get_exchange_id()
+        delay = timestamp - self.kernel.get_current_time()
+        if self.replay == "diff":
+            # Every change of a snapshot shares one noise so that cancels, size changes and adds keep their order,
+            # and a snapshot never overtakes the previous one since its diffs refer to the orders that one added
+            delivery = timestamp + pd.Timedelta(seconds=random.uniform(0, 1)).round("10ms")
+            if self._last_delivery is not None and delivery < self._last_delivery:
+                delivery = self._last_delivery
+            self._last_delivery = delivery
+            for message in self._diff_messages(index, timestamp):
+                self.kernel.send_message("", exchange_id, message, delivery - self.kernel.get_current_time())
+            return
+        for order in self._make_orders(index, timestamp):
+            noise_seconds = random.uniform(0, 1)
+            noise_delay = pd.Timedelta(seconds=noise_seconds).round("10ms")
+            self.kernel.send_message("", exchange_id, Message(MessageType.LIMIT_ORDER, order), delay + noise_delay)
+    
+    def _diff_messages(self, index, timestamp):
+        """ Turn the index-th snapshot into cancels, size reductions and adds against the previous one
+        
+        The diff is done per (side, price) level in the stored units. Size increases join the back of
+        the queue as new orders, reductions shrink or cancel the newest orders of the level first.
+        """
+        start, stop = self._offsets[index], self._offsets[index + 1]
+        snapshot = {}
+        for side, price, volume in zip(self._sides[start:stop].tolist(), self._prices[start:stop].tolist(), self._volumes[start:stop].tolist()):
+            snapshot[(side, price)] = snapshot.get((side, price), 0) + volume
+        
+        cancels, modifies, adds = [], [], []
+        for key in [key for key in self._replay_levels if key not in snapshot]:
+            for order_id, _ in self._replay_levels.pop(key)[1]:
+                cancels.append(Message(MessageType.CANCEL_ORDER, {"order_id": order_id, "symbol": self.symbol, "agent_id": "Market"}))
+        for (side, price), volume in snapshot.items():
+            level = self._replay_levels.get((side, price))
+            resting = level[0] if level is not None else 0
+            if volume > resting:
+                order = LimitOrder("Market", timestamp, self.symbol, (volume - resting) / self._volume_scale, Side(side), price / self._price_scale)
+                if level is None:
+                    level = self._replay_levels[(side, price)] = [0, []]
+                level[1].append([order.order_id, volume - resting])
+                adds.append(Message(MessageType.LIMIT_ORDER, order))
+            elif volume < resting:
+                excess = resting - volume
+                orders = level[1]
+                while excess > 0 and orders:
+                    order_id, order_volume = orders[-1]
+                    if order_volume <= excess:
+                        orders.pop()
+                        excess -= order_volume
+                        cancels.append(Message(MessageType.CANCEL_ORDER, {"order_id": order_id, "symbol": self.symbol, "agent_id": "Market"}))
+                    else:
+                        orders[-1][1] = order_volume - excess
+                        excess = 0
+                        modifies.append(Message(MessageType.MODIFY_ORDER, {"order_id": order_id, "quantity": orders[-1][1] / self._volume_scale, "symbol": self.symbol,
+                                                                            "agent_id": "Market"}))
+            if level is not None:
+                level[0] = volume
+        return cancels + modifies + adds
+    
+    def _make_orders(self, index, timestamp):
+        """ Build the LimitOrder objects of a timestamp from the columnar arrays """
+        start, stop = self._offsets[index], self._offsets[index + 1]
+        rows = zip(self._sides[start:stop].tolist(), (self._prices[start:stop] / self._price_scale).tolist(),
+                   (self._volumes[start:stop] / self._volume_scale).tolist(), self._qids[start:stop].tolist())
+        return [LimitOrder("Market", timestamp, self.symbol, volume, Side(side), price, id) for side, price, volume, id in rows]
+    
+    def stream_orders(self, current_time):
+        """ Send the orders of every timestamp falling within one stream window of current_time """
+        horizon = current_time + self._stream_window
+        while self._cursor < len(self._timestamps) and self._timestamps[self._cursor] <= horizon:
+            self.send_orders(self._cursor)
+            self._cursor += 1
+        # Wake up again when the next timestamp enters the window
+        if self._cursor < len(self._timestamps):
+            self.kernel.schedule_timer(self.stream_orders, start_time=self._timestamps[self._cursor] - self._stream_window)
         
     def get_orders(self, timestamp):
-        return self._orders[timestamp]
+        return self._make_orders(self._timestamps.get_loc(timestamp), timestamp)
     
     def get_start_time(self):
         return self._timestamps[0]
@@ -46,10 +181,25 @@ class DataOracle:
     def get_timestamps(self):
         return self._timestamps
     
+    def get_state(self):
+        """ Replay position, the market data itself is read-only and never part of a snapshot """
+        return self._cursor, copy.deepcopy(self._replay_levels), self._last_delivery
+    
+    def set_state(self, state):
+        self._cursor = state[0]
+        self._replay_levels = copy.deepcopy(state[1])
+        self._last_delivery = state[2]
+    
     def kernel_init(self, kernel):
         self.kernel = kernel
     
     def kernel_start(self, start_time):
         self.start_time = start_time
-        self.pre_send_orders()
+        self._replay_levels = {}
+        self._last_delivery = None
+        if self.streaming:
+            self._cursor = 0
+            self.stream_orders(start_time)
+        else:
+            self.pre_send_orders()
         
\ No newline at end of file
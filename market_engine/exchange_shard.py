@@ -0,0 +1,143 @@
+from typing import Dict, List, Optional, Union
+import multiprocessing
+
+from market_engine.order_book import OrderBook
+from util.message import Message
+from util.types import MessageType, Side
+from util.logger import DummyLogger
+
+ORDER_MESSAGES = (MessageType.LIMIT_ORDER, MessageType.MARKET_ORDER, MessageType.CANCEL_ORDER, MessageType.MODIFY_ORDER)
+
+
+class ExchangeShard:
+    """ Order books of some of the exchange's symbols, order messages are routed to the book of their symbol
+
+    Cancels and modifies carry the symbol of their order, those without one (older agents) go to the
+    only book of the shard or to the book where the order rests. They also carry the id of the requesting
+    agent and are ignored unless that agent placed the order. Acknowledgements and execution reports are
+    sent through owner.send_message(recipient, message).
+    """
+
+    def __init__(self, books:Dict[str, OrderBook], owner):
+        self.books = books
+        self.owner = owner
+        for book in books.values():
+            book.set_owner(owner)
+
+    @classmethod
+    def create(cls, symbols:List[str], owner, logger=DummyLogger(), tick_size:Union[float, Dict[str, float]]=0.01):
+        """ Shard with a new book per symbol, tick_size is one tick size for every book or a symbol -> tick size mapping """
+        return cls({symbol: OrderBook(symbol, owner, logger, tick_size[symbol] if isinstance(tick_size, dict) else tick_size)
+                    for symbol in symbols}, owner)
+
+    def book_of(self, content) -> Optional[OrderBook]:
+        """ Book an order message applies to, None if no book of the shard knows the order """
+        if len(self.books) == 1:
+            return next(iter(self.books.values()))
+        symbol = content.symbol if not isinstance(content, dict) else content.get("symbol")
+        if symbol is not None:
+            return self.books[symbol]
+        for book in self.books.values():
+            if book.get_order(content["order_id"]) is not None:
+                return book
+        return None
+
+    def handle(self, message:Message):
+        content = message.content
+        book = self.book_of(content)
+        if book is None:
+            return
+        message_type = message.type
+        if message_type in (MessageType.LIMIT_ORDER, MessageType.MARKET_ORDER):
+            book.send_order(content)
+        elif content.get("agent_id") is None:
+            # a cancel or modify that does not say who asks for it could remove anyone's order
+            return
+        elif message_type == MessageType.CANCEL_ORDER:
+            order = book.cancel_order(content["order_id"], content["agent_id"])
+            if order is not None:
+                self.owner.send_message(order.agent_id, Message(MessageType.ORDER_CANCELLED, order.order_id))
+        elif message_type == MessageType.MODIFY_ORDER:
+            quantity = content["quantity"]
+            order = book.modify_order(content["order_id"], quantity, content["agent_id"])
+            if order is not None and quantity <= 0:
+                # a modify down to zero removed the order
+                self.owner.send_message(order.agent_id, Message(MessageType.ORDER_CANCELLED, order.order_id))
+
+    def depths(self, depth:int) -> Dict:
+        """ Mid price and copies of the (levels, 3) bid and ask depth of every book """
+        return {symbol: (book.mid_price(), book.get_depth(Side.BUY, depth).copy(), book.get_depth(Side.SELL, depth).copy())
+                for symbol, book in self.books.items()}
+
+
+class _Outbox:
+    """ Collects the messages a worker's books send during a time slice """
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, recipient_id, message):
+        self.messages.append((recipient_id, message))
+
+
+def _run_shard(connection, books:Dict[str, OrderBook]):
+    outbox = _Outbox()
+    shard = ExchangeShard(books, outbox)
+    while True:
+        command, payload = connection.recv()
+        if command == "process":
+            messages, depth = payload
+            for message in messages:
+                shard.handle(message)
+            connection.send((outbox.messages, shard.depths(depth) if depth else None))
+            outbox.messages = []
+        elif command == "books":
+            connection.send(shard.books)
+        elif command == "stop":
+            connection.close()
+            return
+
+
+class ShardProcess:
+    """ Worker process hosting an ExchangeShard, fed one batch of order messages per time slice
+
+    submit sends the batch queued in pending and returns at once, so that every shard works on its
+    slice in parallel before the results are collected.
+    """
+
+    def __init__(self, books:Dict[str, OrderBook]):
+        self.symbols = list(books)
+        self.pending: List[Message] = []
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+        self._connection, child = context.Pipe()
+        for book in books.values():
+            book.set_owner(None)
+        self._process = context.Process(target=_run_shard, args=(child, books), daemon=True)
+        self._process.start()
+        child.close()
+
+    def submit(self, depth:int=0):
+        self._connection.send(("process", (self.pending, depth)))
+        self.pending = []
+
+    def collect(self):
+        """ (messages sent by the books as (recipient, message), depths or None) of the last submitted slice """
+        return self._connection.recv()
+
+    def books(self) -> Dict[str, OrderBook]:
+        self._connection.send(("books", None))
+        return self._connection.recv()
+
+    def stop(self):
+        if self._process.is_alive():
+            self._connection.send(("stop", None))
+            self._process.join()
+        self._connection.close()
+
+
+def shard_symbols(symbols:List[str], num_shards:int) -> List[List[str]]:
+    """ Spread symbols round robin over num_shards groups """
+    return [group for group in (list(symbols[i::num_shards]) for i in range(max(num_shards, 1))) if group]
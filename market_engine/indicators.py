@@ -0,0 +1,183 @@
+from collections import deque
+import math
+
+from market_engine.analytics_history import AnalyticsHistory
+
+
+class Indicator:
+    """ Indicator updated in O(1) from each new analytics row, value is None until it is warmed up """
+
+    def __init__(self):
+        self.value = None
+
+    def update(self, history:AnalyticsHistory, row:int):
+        raise NotImplementedError
+
+
+class RollingSum:
+    """ Sum of the last length values
+
+    An inf or NaN never cancels out of a running total, so while one is in the window the sum is
+    recomputed from the values and it is exact again once the value has left the window.
+    """
+
+    def __init__(self, length:int):
+        self.length = length
+        self.total = 0.0
+        self._values = deque()
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, value:float) -> float:
+        value = float(value)
+        self._values.append(value)
+        removed = self._values.popleft() if len(self._values) > self.length else 0.0
+        if math.isfinite(self.total) and math.isfinite(value) and math.isfinite(removed):
+            self.total += value
+            self.total -= removed
+        else:
+            self.total = sum(self._values)
+        return self.total
+
+
+class OrderStrength(Indicator):
+    """ (bid volume - ask volume) / total volume over the top levels of the last length snapshots """
+
+    def __init__(self, length:int):
+        super().__init__()
+        self._buys = RollingSum(length)
+        self._sells = RollingSum(length)
+
+    def update(self, history:AnalyticsHistory, row:int):
+        total_buys = self._buys.add(history.bid_volumes[row].sum())
+        total_sells = self._sells.add(history.ask_volumes[row].sum())
+        total_volume = total_buys + total_sells
+        self.value = (total_buys - total_sells) / total_volume if total_volume != 0 else 0
+
+
+class WilderRSI(Indicator):
+    """ Relative strength index of the mid price with Wilder smoothing, seeded by the mean of the first length changes """
+
+    def __init__(self, length:int=14):
+        super().__init__()
+        self.length = length
+        self._last_price = None
+        self._count = 0
+        self._average_gain = 0.0
+        self._average_loss = 0.0
+
+    def update(self, history:AnalyticsHistory, row:int):
+        price = history.mid_prices[row]
+        if math.isnan(price):
+            return
+        if self._last_price is not None:
+            change = price - self._last_price
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            self._count += 1
+            if self._count <= self.length:
+                self._average_gain += gain / self.length
+                self._average_loss += loss / self.length
+            else:
+                self._average_gain = (self._average_gain * (self.length - 1) + gain) / self.length
+                self._average_loss = (self._average_loss * (self.length - 1) + loss) / self.length
+            if self._count >= self.length:
+                if self._average_loss == 0:
+                    self.value = 100
+                else:
+                    self.value = 100 - 100 / (1 + self._average_gain / self._average_loss)
+        self._last_price = price
+
+
+class RealizedVolatility(Indicator):
+    """ Square root of the sum of squared mid price log returns over the last length snapshots """
+
+    def __init__(self, length:int):
+        super().__init__()
+        self._squared_returns = RollingSum(length)
+        self._last_price = None
+
+    def update(self, history:AnalyticsHistory, row:int):
+        price = history.mid_prices[row]
+        if math.isnan(price):
+            return
+        if self._last_price is not None:
+            log_return = math.log(price / self._last_price)
+            self.value = math.sqrt(max(self._squared_returns.add(log_return * log_return), 0.0))
+        self._last_price = price
+
+
+class EWMAVolatility(Indicator):
+    """ Exponentially weighted volatility of mid price log returns, decay is the weight of the past variance """
+
+    def __init__(self, decay:float=0.94):
+        super().__init__()
+        self.decay = decay
+        self._variance = None
+        self._last_price = None
+
+    def update(self, history:AnalyticsHistory, row:int):
+        price = history.mid_prices[row]
+        if math.isnan(price):
+            return
+        if self._last_price is not None:
+            log_return = math.log(price / self._last_price)
+            if self._variance is None:
+                self._variance = log_return * log_return
+            else:
+                self._variance = self.decay * self._variance + (1 - self.decay) * log_return * log_return
+            self.value = math.sqrt(self._variance)
+        self._last_price = price
+
+
+class OrderFlowImbalance(Indicator):
+    """ Best level order flow imbalance (Cont, Kukanov and Stoikov) summed over the last length snapshots """
+
+    def __init__(self, length:int):
+        super().__init__()
+        self._flows = RollingSum(length)
+        self._last = None
+
+    def update(self, history:AnalyticsHistory, row:int):
+        # Python floats overflow to inf silently where NumPy scalars warn
+        bid_price, bid_volume = history.bid_prices[row, 0].item(), history.bid_volumes[row, 0].item()
+        ask_price, ask_volume = history.ask_prices[row, 0].item(), history.ask_volumes[row, 0].item()
+        # rows without a best level or with overflowed volumes are skipped
+        if math.isnan(bid_price) or math.isnan(ask_price) or not math.isfinite(bid_volume + ask_volume):
+            return
+        if self._last is not None:
+            last_bid_price, last_bid_volume, last_ask_price, last_ask_volume = self._last
+            flow = 0.0
+            if bid_price >= last_bid_price:
+                flow += bid_volume
+            if bid_price <= last_bid_price:
+                flow -= last_bid_volume
+            if ask_price <= last_ask_price:
+                flow -= ask_volume
+            if ask_price >= last_ask_price:
+                flow += last_ask_volume
+            self.value = self._flows.add(flow)
+        self._last = (bid_price, bid_volume, ask_price, ask_volume)
+
+
+class Microprice(Indicator):
+    """ Best bid and ask weighted by the volume on the opposite side """
+
+    def update(self, history:AnalyticsHistory, row:int):
+        # Python floats overflow to inf silently where NumPy scalars warn
+        bid_price, bid_volume = history.bid_prices[row, 0].item(), history.bid_volumes[row, 0].item()
+        ask_price, ask_volume = history.ask_prices[row, 0].item(), history.ask_volumes[row, 0].item()
+        if math.isnan(bid_price) or math.isnan(ask_price) or not 0 < bid_volume + ask_volume < math.inf:
+            return
+        self.value = (bid_price * ask_volume + ask_price * bid_volume) / (bid_volume + ask_volume)
+
+
+def default_indicators():
+    return {
+        "order_strength_10": OrderStrength(10),
+        "rsi_14": WilderRSI(14),
+        "realized_volatility_100": RealizedVolatility(100),
+        "ewma_volatility": EWMAVolatility(0.94),
+        "ofi_10": OrderFlowImbalance(10),
+        "microprice": Microprice(),
+    }
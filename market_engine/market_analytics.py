@@ -1,54 +1,191 @@
-from typing import Dict
+from typing import Dict, List
 import numpy as np
 
+from market_engine.analytics_history import AnalyticsHistory
+from market_engine.indicators import Indicator, default_indicators
+from market_engine.observation import ObservationBuilder
 from market_engine.order_book import OrderBook
+from util.types import Side
 
 
 class OrderBookState:
-    def __init__(self, 
-                 symbol, 
-                 timestamp, 
-                 buy_side:Dict[int, int], 
-                 sell_side:Dict[int, int], 
+    def __init__(self,
+                 symbol,
+                 timestamp,
+                 bids:np.ndarray,
+                 asks:np.ndarray,
                  mid_price:int):
+        """ Top levels of the book at a timestamp, bids and asks are (levels, 2) arrays of price and volume, best first """
         self.timestamp = timestamp
         self.symbol = symbol
-        self.buy_side = buy_side
-        self.sell_side = sell_side
+        self.bids = bids
+        self.asks = asks
         self.mid_price = mid_price
-    
+
+    @property
+    def buy_side(self) -> Dict[int, int]:
+        return dict(self.bids[:, :2].tolist())
+
+    @property
+    def sell_side(self) -> Dict[int, int]:
+        return dict(self.asks[:, :2].tolist())
+
     def volume_buy(self):
-        return sum(self.buy_side.values())
-    
+        return self.bids[:, 1].sum()
+
     def volume_sell(self):
-        return sum(self.sell_side.values())
+        return self.asks[:, 1].sum()
 
 class MarketAnalytics:
-    def __init__(self, symbol:str, depth:int):
+    def __init__(self, symbol:str, depth:int, retention:int=10000, indicators:Dict[str, Indicator]=None, observation_length:int=0):
+        """ Book analytics over the last retention snapshots, older ones are dropped
+
+        Registered indicators are updated once per snapshot, by default those of default_indicators(). They
+        cost about a third of the update throughput (about 6k against 10k updates per second in the
+        analytics_update benchmarks baseline), pass indicators={} when nothing reads them.
+        With observation_length > 0 the last observation_length snapshots are also kept as a
+        (observation_length, 4, depth) tensor that views hand out without copying, see ObservationBuilder.
+        """
         self.symbol = symbol
         self.depth = depth
-        #self.order_book_snapshots = {}
-        self.order_book_state = {}
-        self.timestamps = []
-        self.prices = []
+        self.history = AnalyticsHistory(retention, depth)
+        self.indicators: Dict[str, Indicator] = default_indicators() if indicators is None else dict(indicators)
+        self.observations = ObservationBuilder(observation_length, depth, retention) if observation_length > 0 else None
+
+    def register_indicator(self, name:str, indicator:Indicator):
+        self.indicators[name] = indicator
+
+    def indicator(self, name:str):
+        return self.indicators[name].value
+
+    def view(self) -> 'MarketAnalyticsView':
+        """ Read-only view of the history and indicator values as they are now, sharing the history storage """
+        return MarketAnalyticsView(self, self.history.version)
 
     def order_strength(self, length:int):
-        buy_volumes = [self.order_book_state[t].volume_buy() for t in self.timestamps[-length:]]
-        sell_volumes = [self.order_book_state[t].volume_sell() for t in self.timestamps[-length:]]
-        total_buys = sum(buy_volumes)
-        total_sells = sum(sell_volumes)
+        return self.view().order_strength(length)
+
+    def realized_volatility(self, length:int):
+        return self.view().realized_volatility(length)
+
+    def relative_strength_index(self, length:int):
+        return self.view().relative_strength_index(length)
+
+    def update(self, timestamp, order_book:OrderBook):
+        self.update_levels(timestamp, order_book.mid_price(), order_book.get_depth(Side.BUY, self.depth), order_book.get_depth(Side.SELL, self.depth))
+
+    def update_levels(self, timestamp, mid_price, bids:np.ndarray, asks:np.ndarray):
+        """ Same as update from the mid price and (levels, 2+) depth arrays of a book held elsewhere """
+        self.history.append(timestamp, mid_price, bids, asks)
+        if self.observations is not None:
+            self.observations.update(bids, asks)
+        row = self.history.row(self.history.version - 1)
+        for indicator in self.indicators.values():
+            indicator.update(self.history, row)
+
+    def best_bid(self):
+        return self.view().best_bid()
+
+    def best_ask(self):
+        return self.view().best_ask()
+
+    def __str__(self):
+        mid_price = self.history.mid_prices[self.history.row(self.history.version - 1)] if self.history.version else np.nan
+        return (f"MarketAnalytics for {self.symbol}: {self.history.version} timestamps processed, current mid price: {mid_price if not np.isnan(mid_price) else 'N/A'}")
+
+
+def _read_only(view:np.ndarray) -> np.ndarray:
+    view.flags.writeable = False
+    return view
+
+
+class MarketAnalyticsView:
+    """ Consistent view of a MarketAnalytics history at a version, without copying it
+
+    Rows are never modified once appended, so a view only records how many rows existed when it
+    was taken and ignores everything appended afterwards. Reading rows that have since fallen out
+    of the retention window raises an IndexError. Indicator values are cached when the view is taken.
+    """
+    def __init__(self, analytics:MarketAnalytics, version:int):
+        self._history = analytics.history
+        self.symbol = analytics.symbol
+        self.depth = analytics.depth
+        self.version = version
+        self.indicators = {name: indicator.value for name, indicator in analytics.indicators.items()}
+        self._observations = analytics.observations
+        self._observation_version = analytics.observations.version if analytics.observations is not None else 0
+
+    def indicator(self, name:str):
+        return self.indicators[name]
+
+    def observation(self) -> np.ndarray:
+        """ Read-only (T, 4, depth) view of the bid/ask prices and volumes of the last T snapshots, None without an observation tensor """
+        if self._observations is None:
+            return None
+        return self._observations.observation(self._observation_version)
+
+    @property
+    def timestamp(self):
+        if not self.version:
+            return None
+        return self._history.to_timestamp(self._history.timestamps[self._history.row(self.version - 1)])
+
+    def window(self, length:int) -> Dict[str, np.ndarray]:
+        """ Zero-copy, read-only arrays of the last length rows of the view, oldest first
+
+        They share the history of every agent's views, copy them before changing them.
+        """
+        history = self._history
+        rows = history.window(length, self.version)
+        return {name: _read_only(getattr(history, name)[rows])
+                for name in ('timestamps', 'mid_prices', 'bid_prices', 'bid_volumes', 'ask_prices', 'ask_volumes')}
+
+    def state(self, offset:int=-1) -> OrderBookState:
+        """ Book state at a negative offset from the view's last update """
+        history = self._history
+        row = history.row(self.version + offset)
+        bid_count = np.count_nonzero(~np.isnan(history.bid_prices[row]))
+        ask_count = np.count_nonzero(~np.isnan(history.ask_prices[row]))
+        bids = np.column_stack((history.bid_prices[row, :bid_count], history.bid_volumes[row, :bid_count]))
+        asks = np.column_stack((history.ask_prices[row, :ask_count], history.ask_volumes[row, :ask_count]))
+        mid_price = history.mid_prices[row]
+        return OrderBookState(self.symbol, history.to_timestamp(history.timestamps[row]), bids, asks,
+                              mid_price if not np.isnan(mid_price) else None)
+
+    def last_prices(self, length:int) -> np.ndarray:
+        """ Read-only mid prices of the last length rows, NaN where the book had no mid price """
+        return _read_only(self._history.mid_prices[self._history.window(length, self.version)])
+
+    def order_strength(self, length:int):
+        if f"order_strength_{length}" in self.indicators:
+            return self.indicators[f"order_strength_{length}"]
+        rows = self._history.window(length, self.version)
+        total_buys = self._history.bid_volumes[rows].sum()
+        total_sells = self._history.ask_volumes[rows].sum()
         total_volume = total_buys + total_sells
         if total_volume == 0:
-            return 0 
+            return 0
         return (total_buys - total_sells) / total_volume
-    
+
     def realized_volatility(self, length:int):
-        pass 
-    
+        if f"realized_volatility_{length}" in self.indicators:
+            return self.indicators[f"realized_volatility_{length}"]
+        prices = self.last_prices(length + 1)
+        prices = prices[~np.isnan(prices)]
+        if len(prices) < 2:
+            return None  # Not enough data
+        return np.sqrt(np.sum(np.diff(np.log(prices)) ** 2))
+
+    def microprice(self):
+        return self.indicators.get("microprice")
+
     def relative_strength_index(self, length:int):
-        if len(self.prices) < length + 1:
+        """ Cutler's RSI over the last length changes, the registered Wilder RSI is available as indicator("rsi_14") """
+        prices = self.last_prices(length + 1)
+        prices = prices[~np.isnan(prices)]
+        if len(prices) < length + 1:
             return None  # Not enough data
-        changes = np.diff(self.prices[-(length + 1):])
+        changes = np.diff(prices)
         gains = np.maximum(changes, 0)
         losses = -np.minimum(changes, 0)
         average_gain = np.mean(gains)
@@ -58,28 +195,22 @@ class MarketAnalytics:
         rs = average_gain / average_loss
         rsi = 100 - (100 / (1 + rs))
         return rsi
-    
-    def update(self, timestamp, order_book:OrderBook):
-        #self.order_book_snapshots[timestamp] = order_book
-        buy_side = order_book.get_buy_side(self.depth)
-        sell_side = order_book.get_sell_side(self.depth)
-        mid_price = order_book.mid_price()
-        order_book_state = OrderBookState(self.symbol, timestamp, buy_side, sell_side, mid_price)
-        self.order_book_state[timestamp] = order_book_state
-        self.timestamps.append(timestamp)
-        if mid_price is not None:
-            self.prices.append(mid_price)
-            
+
     def best_bid(self):
-        keys = list(self.order_book_state[self.timestamps[-1]].buy_side.keys())
-        values = list(self.order_book_state[self.timestamps[-1]].buy_side.values())
-        return (keys[0], values[0])
-    
+        """ (price, volume) of the best bid at the view's last update, (None, None) if there are no bids """
+        if not self.version:
+            return (None, None)
+        row = self._history.row(self.version - 1)
+        price = self._history.bid_prices[row, 0]
+        return (price.item(), self._history.bid_volumes[row, 0].item()) if not np.isnan(price) else (None, None)
+
     def best_ask(self):
-        keys = list(self.order_book_state[self.timestamps[-1]].sell_side.keys())
-        values = list(self.order_book_state[self.timestamps[-1]].sell_side.values())
-        return (keys[0], values[0])
-    
+        """ (price, volume) of the best ask at the view's last update, (None, None) if there are no asks """
+        if not self.version:
+            return (None, None)
+        row = self._history.row(self.version - 1)
+        price = self._history.ask_prices[row, 0]
+        return (price.item(), self._history.ask_volumes[row, 0].item()) if not np.isnan(price) else (None, None)
+
     def __str__(self):
-        return (f"MarketAnalytics for {self.symbol}: {len(self.timestamps)} timestamps processed, current mid price: {self.prices[-1] if self.prices else 'N/A'}")
-        
\ No newline at end of file
+        return (f"MarketAnalytics view for {self.symbol} at version {self.version}")
@@ -0,0 +1,48 @@
+from typing import Optional
+import numpy as np
+
+# Channels of the second axis of an observation
+BID_PRICES, BID_VOLUMES, ASK_PRICES, ASK_VOLUMES = 0, 1, 2, 3
+
+
+class ObservationBuilder:
+    """ Rolling (length, 4, levels) tensor of the last book snapshots, the state layout of the RL agents
+
+    Snapshots are stored with the four channels (bid prices, bid volumes, ask prices, ask volumes)
+    already interleaved, each row written twice at position i and i + capacity as in AnalyticsHistory,
+    so that the observation at any of the last capacity - length + 1 versions is a contiguous view of
+    the buffer. Missing levels, and the rows before the first snapshot, are zero rather than NaN.
+    """
+
+    def __init__(self, length:int, levels:int, capacity:Optional[int]=None, dtype=np.float32):
+        self.length = length
+        self.levels = levels
+        self.capacity = max(capacity or 0, length)
+        self.version = 0  # number of snapshots ever written
+        self.buffer = np.zeros((2 * self.capacity, 4, levels), dtype=dtype)
+
+    def update(self, bids:np.ndarray, asks:np.ndarray):
+        """ Write one snapshot, bids and asks are (levels, 2+) arrays of price and volume, best first """
+        position = self.version % self.capacity
+        row = self.buffer[position]
+        bid_count = min(len(bids), self.levels)
+        ask_count = min(len(asks), self.levels)
+        row[BID_PRICES, :bid_count] = bids[:bid_count, 0]
+        row[BID_VOLUMES, :bid_count] = bids[:bid_count, 1]
+        row[BID_PRICES:BID_VOLUMES + 1, bid_count:] = 0
+        row[ASK_PRICES, :ask_count] = asks[:ask_count, 0]
+        row[ASK_VOLUMES, :ask_count] = asks[:ask_count, 1]
+        row[ASK_PRICES:ASK_VOLUMES + 1, ask_count:] = 0
+        self.buffer[position + self.capacity] = row
+        self.version += 1
+
+    def observation(self, version:Optional[int]=None) -> np.ndarray:
+        """ Read-only (length, 4, levels) view of the snapshots [version - length, version), oldest first """
+        version = self.version if version is None else version
+        if not self.version - self.capacity + self.length <= version <= self.version:
+            raise IndexError(f"Observation at version {version} is overwritten or not written yet (current version: {self.version})")
+        # Before the first length snapshots the window starts in the unwritten tail of the first half, which is still zero
+        start = (version - self.length) % self.capacity
+        view = self.buffer[start:start + self.length]
+        view.flags.writeable = False
+        return view
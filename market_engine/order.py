@@ -1,7 +1,11 @@
+from typing import Iterator, List
+import numpy as np
+
 from util.types import Side
 
 class Order:
-    order_id: int = 0
+    __slots__ = ('agent_id', 'time_placed', 'symbol', 'quantity', 'side', 'order_id', 'remaining_quantity')
+    last_order_id: int = 0
     
     def __init__(self, agent_id:str, time_placed:int, symbol:str, quantity:int, side:Side, order_id:int=None):
         """ Order object """
@@ -14,11 +18,13 @@ class Order:
         self.remaining_quantity = quantity
         
     def generate_order_id(self):
-        Order.order_id += 1
-        return Order.order_id
+        Order.last_order_id += 1
+        return Order.last_order_id
 
 
 class MarketOrder(Order):
+    __slots__ = ()
+    
     def __init__(self, agent_id:str, time_placed:int, symbol:str, quantity:int, side:Side, order_id:int=None):
         """ Market Order object"""
         super().__init__(agent_id, time_placed, symbol, quantity, side, order_id)
@@ -28,6 +34,8 @@ class MarketOrder(Order):
         
 
 class LimitOrder(Order):
+    __slots__ = ('limit_price',)
+    
     def __init__(self, agent_id:str, time_placed:int, symbol:str, quantity:int, side:Side, limit_price:int, order_id:int=None):
         """ Limit Order object """
         super().__init__(agent_id, time_placed, symbol, quantity, side, order_id)
@@ -37,8 +45,11 @@ class LimitOrder(Order):
         return f"{self.side} {self.quantity} {self.symbol} @ {self.limit_price}"
     
 class FilledOrder:
-    def __init__(self, agent_id:str, symbol:str, filled_quantity:int, side:Side, filled_price:int, fee:int=0):
+    __slots__ = ('agent_id', 'order_id', 'symbol', 'filled_quantity', 'side', 'filled_price', 'fee')
+    
+    def __init__(self, agent_id:str, symbol:str, filled_quantity:int, side:Side, filled_price:int, fee:int=0, order_id:int=None):
         self.agent_id = agent_id
+        self.order_id = order_id
         self.symbol = symbol
         self.filled_quantity = filled_quantity
         self.side = side
@@ -49,3 +60,29 @@ class FilledOrder:
         return f"{self.side} {self.filled_quantity} {self.symbol} @ {self.filled_price}"
 
 
+class ExecutionReport:
+    def __init__(self, agent_id:str, symbol:str, fills:List[tuple]):
+        """ Every fill of one agent caused by a single incoming order, fills are (order_id, side, quantity, price, fee) tuples """
+        self.agent_id = agent_id
+        self.symbol = symbol
+        order_ids, sides, quantities, prices, fees = zip(*fills)
+        self.order_ids = np.array(order_ids, dtype=np.int64)
+        self.sides = np.array(sides, dtype=np.int8)
+        self.quantities = np.array(quantities)
+        self.prices = np.array(prices)
+        self.fees = np.array(fees)
+    
+    def __len__(self):
+        return len(self.order_ids)
+    
+    def signed_quantities(self) -> np.ndarray:
+        """ Quantities, positive for buys and negative for sells """
+        return np.where(self.sides == Side.BUY, self.quantities, -self.quantities)
+    
+    def fills(self) -> Iterator[FilledOrder]:
+        for order_id, side, quantity, price, fee in zip(self.order_ids.tolist(), self.sides.tolist(), self.quantities.tolist(), self.prices.tolist(), self.fees.tolist()):
+            yield FilledOrder(self.agent_id, self.symbol, quantity, Side(side), price, fee, order_id)
+    
+    def __str__(self):
+        return f"{len(self)} fills of {self.quantities.sum()} {self.symbol} for {self.agent_id}"
+
@@ -1,10 +1,10 @@
-from typing import Any, Callable, Deque, Dict, List, Optional
-from collections import defaultdict, deque
-import bisect
+from typing import Dict, List, Optional
 import math
-from copy import deepcopy
 
-from market_engine.order import Order, MarketOrder, LimitOrder, FilledOrder
+import numpy as np
+
+from market_engine.order import Order, MarketOrder, LimitOrder, ExecutionReport
+from market_engine.price_ladder import OrderNode, PriceLadder, PriceLevel
 from util.types import Side, MessageType
 from util.message import Message
 from util.logger import DummyLogger
@@ -12,7 +12,7 @@ from util.logger import DummyLogger
 
 class OrderBook:
 
-    def __init__(self, symbol:str, owner=None, logger=DummyLogger()):
+    def __init__(self, symbol:str, owner=None, logger=DummyLogger(), tick_size:float=0.01, view_depth:int=10):
         """Initialise a new instance of the OrderBook class."""
         self.symbol = symbol
         self.owner = owner # the exchange agent that owns the order book
@@ -21,17 +21,34 @@ class OrderBook:
         
         self.logger = logger
         
-        # Dict that stores the order for each price level 
-        self._levels: Dict[int, Deque[Order]] = defaultdict(deque)         
-        # Price levels for each side 
-        self._bid_prices: List[int] = []
-        self._ask_prices: List[int] = []
-        # Total volume for each price level
-        self._total_volumes: Dict[int, int] = defaultdict(int)
-        self._last_traded_price: Optional[int] = None
+        # Prices are held as integer ticks of the symbol, converted back at the edges
+        self.tick_size = tick_size
+        self._ticks_per_unit = 1 / tick_size
+        # Price levels for each side, best price first, with a depth view of the best view_depth levels
+        self.view_depth = view_depth
+        self._bids = PriceLadder(Side.BUY, view_depth, self._ticks_per_unit)
+        self._asks = PriceLadder(Side.SELL, view_depth, self._ticks_per_unit)
+        # Resting orders by id, the latest order wins if an id is reused
+        self._orders: Dict[int, OrderNode] = {}
+        # Fills of the incoming order being matched, by agent
+        self._fills: Dict[str, List[tuple]] = {}
+        self._last_traded_price: Optional[float] = None
     
     def set_owner(self, owner):
         self.owner = owner
+    
+    def to_ticks(self, price, side:Side=None) -> int:
+        """Tick of a price. Given a side, an off-grid limit price goes to the tick behind it (down for buys,
+        up for sells) so that an order never trades or rests through its own limit."""
+        ticks = price * self._ticks_per_unit
+        tick = round(ticks)
+        # prices on the grid only miss their tick by float noise
+        if side is None or abs(ticks - tick) < 1e-6:
+            return tick
+        return math.floor(ticks) if side == Side.BUY else math.ceil(ticks)
+    
+    def to_price(self, tick:int) -> float:
+        return tick / self._ticks_per_unit
         
     def send_order(self, order: Order):
         """Send an order to the order book."""
@@ -41,142 +58,184 @@ class OrderBook:
             self._insert_order(order)
         else:
             raise ValueError(f"Unknown order type: {order}")
+        if self._fills:
+            self._send_execution_reports()
+    
+    def _send_execution_reports(self):
+        """Notify each agent involved in the last match with a single report of all its fills."""
+        for agent_id, fills in self._fills.items():
+            message = Message(MessageType.ORDER_EXECUTED, ExecutionReport(agent_id, self.symbol, fills))
+            self.owner.send_message(agent_id, message)
+        self._fills = {}
     
     def _insert_order(self, order: LimitOrder):
-        price = order.limit_price
         side = order.side
+        tick = self.to_ticks(order.limit_price, side)
         #self.logger.info(f"Inserting order: {order}, Price: {price}, Side: {side}")
-        while (order.remaining_quantity > 0 and
-               ((side == Side.BUY and self._ask_prices and self._best_ask() is not None and price >= self._best_ask()) or
-                (side == Side.SELL and self._bid_prices and self._best_bid() and price <= self._best_bid()))):
-            best_price = self._best_ask() if side == Side.BUY else self._best_bid()
-            order.remaining_quantity = self._trade_level(order, best_price, side)
-            
+        if side == Side.BUY:
+            book_side, opposite = self._bids, self._asks
+            while order.remaining_quantity > 0 and opposite and tick >= opposite.best_tick():
+                order.remaining_quantity = self._trade_level(order, opposite)
+        else:
+            book_side, opposite = self._asks, self._bids
+            while order.remaining_quantity > 0 and opposite and tick <= opposite.best_tick():
+                order.remaining_quantity = self._trade_level(order, opposite)
 
         if order.remaining_quantity > 0:
-            self._levels[price].append(order)
-            self._total_volumes[price] += order.remaining_quantity
-            if side == Side.BUY:
-                if price not in self._bid_prices:
-                    bisect.insort(self._bid_prices, price)
-            elif side == Side.SELL:
-                if price not in self._ask_prices:
-                    bisect.insort(self._ask_prices, price)
+            self._rest_order(order, book_side.get_or_add(tick))
+    
+    def _rest_order(self, order: LimitOrder, level: PriceLevel):
+        self._orders[order.order_id] = level.append(order)
+        level.volume += order.remaining_quantity
+        self._ladder(order.side).touch(level.tick)
+    
+    def cancel_order(self, order_id:int, agent_id:str=None) -> Optional[LimitOrder]:
+        """Remove a resting order, return it or None if it is not in the book anymore.
+        
+        Given an agent_id, orders of other agents are left untouched and None is returned.
+        """
+        node = self._orders.get(order_id)
+        if node is None or (agent_id is not None and node.order.agent_id != agent_id):
+            return None
+        del self._orders[order_id]
+        order, level = node.order, node.level
+        level.unlink(node)
+        level.volume -= order.remaining_quantity
+        if not level:
+            self._ladder(order.side).remove(level.tick)
+        else:
+            self._ladder(order.side).touch(level.tick)
+        return order
+    
+    def modify_order(self, order_id:int, quantity, agent_id:str=None) -> Optional[LimitOrder]:
+        """Reduce the remaining quantity of a resting order in place, keeping its time priority.
+        
+        A quantity of zero cancels the order, increases are ignored since they would need a new place in the queue.
+        Returns the order, or None if nothing changed. Given an agent_id, orders of other agents are left untouched.
+        """
+        node = self._orders.get(order_id)
+        if node is None or quantity >= node.order.remaining_quantity or (agent_id is not None and node.order.agent_id != agent_id):
+            return None
+        if quantity <= 0:
+            return self.cancel_order(order_id)
+        order = node.order
+        node.level.volume -= order.remaining_quantity - quantity
+        order.remaining_quantity = quantity
+        self._ladder(order.side).touch(node.level.tick)
+        return order
+    
+    def get_order(self, order_id:int) -> Optional[LimitOrder]:
+        """Return a resting order, it is the book's own object: read it, change it through cancel_order and modify_order."""
+        node = self._orders.get(order_id)
+        return node.order if node is not None else None
+    
+    def _ladder(self, side:Side) -> PriceLadder:
+        return self._bids if side == Side.BUY else self._asks
+    
+    def __getstate__(self):
+        """Save resting orders as flat lists so that copies and pickles do not recurse along the queues.
+        
+        Level volumes are saved as they are, summing the orders again could round differently."""
+        state = self.__dict__.copy()
+        del state['_bids'], state['_asks'], state['_orders']
+        state['_resting'] = [(level.volume, list(level)) for ladder in (self._bids, self._asks) for level in ladder.levels_from_best()]
+        return state
+    
+    def __setstate__(self, state):
+        resting = state.pop('_resting')
+        self.__dict__.update(state)
+        self._bids = PriceLadder(Side.BUY, self.view_depth, self._ticks_per_unit)
+        self._asks = PriceLadder(Side.SELL, self.view_depth, self._ticks_per_unit)
+        self._orders = {}
+        for volume, orders in resting:
+            level = self._ladder(orders[0].side).get_or_add(self.to_ticks(orders[0].limit_price, orders[0].side))
+            for order in orders:
+                self._rest_order(order, level)
+            level.volume = volume
     
     def _trade_order(self, order: MarketOrder):
         """Send a market order to the order book."""
-        side = order.side
-        prices = self._ask_prices if side == Side.BUY else self._bid_prices
-        while order.remaining_quantity > 0 and prices:
-            best_price = prices[0] if side == Side.BUY else prices[-1]
-            order.remaining_quantity = self._trade_level(order, best_price, side)
+        opposite = self._asks if order.side == Side.BUY else self._bids
+        while order.remaining_quantity > 0 and opposite:
+            order.remaining_quantity = self._trade_level(order, opposite)
                 
-    def _trade_level(self, incoming_order: Order, price: int, side: Side):
-        """Trade an order with existing orders at a given price level."""
-        queue = self._levels[price]
-        while queue and incoming_order.remaining_quantity > 0:
-            current_order = queue[0]
+    def _trade_level(self, incoming_order: Order, ladder: PriceLadder):
+        """Trade an order with existing orders at the best price level of a ladder."""
+        level = ladder.best_level()
+        price = self.to_price(level.tick)
+        while level.head is not None and incoming_order.remaining_quantity > 0:
+            node = level.head
+            current_order = node.order
             traded_quantity = min(current_order.remaining_quantity, incoming_order.remaining_quantity)
             
             # update remaining quantities
             current_order.remaining_quantity -= traded_quantity
             incoming_order.remaining_quantity -= traded_quantity
             
-            # notify the owner 
+            # record the fills of both sides, reported once the incoming order is done matching
             if traded_quantity > 0:
-                # send a message to the agent that placed the order initially
-                maker_filled_order = FilledOrder(current_order.agent_id, current_order.symbol, traded_quantity, current_order.side, price, self.maker_fee)
-                message = Message(MessageType.ORDER_EXECUTED, maker_filled_order)
-                self.owner.send_message(current_order.agent_id, message)
-                # send a message to the agent that placed the incoming order
-                taker_filled_order = FilledOrder(incoming_order.agent_id, incoming_order.symbol, traded_quantity, incoming_order.side, price, self.taker_fee)
-                message = Message(MessageType.ORDER_EXECUTED, taker_filled_order)
-                self.owner.send_message(incoming_order.agent_id, message)
+                fills = self._fills
+                maker_fill = (current_order.order_id, current_order.side, traded_quantity, price, self.maker_fee)
+                fills.setdefault(current_order.agent_id, []).append(maker_fill)
+                taker_fill = (incoming_order.order_id, incoming_order.side, traded_quantity, price, self.taker_fee)
+                fills.setdefault(incoming_order.agent_id, []).append(taker_fill)
             
-            self._total_volumes[price] -= traded_quantity
+            level.volume -= traded_quantity
             self._last_traded_price = price
             if current_order.remaining_quantity == 0:
-                queue.popleft()
-            if self._total_volumes[price] == 0:
-                self._remove_level(price, side)
+                level.unlink(node)
+                if self._orders.get(current_order.order_id) is node:
+                    del self._orders[current_order.order_id]
+        
+        # Levels are removed as soon as they are empty so the best price is always live
+        if not level:
+            ladder.remove(level.tick)
+        else:
+            ladder.touch(level.tick)
 
         return incoming_order.remaining_quantity
-    
-    def _remove_level(self, price: int, side):
-        """Remove a price level from the order book."""
-        #print(f"Removing level {price} on side {side}")
-        if side == Side.BUY:
-            if price in self._bid_prices:
-                self._bid_prices.remove(price)
-                #print(f"Removed {price} from bid prices.")
-        elif side == Side.SELL:
-            if price in self._ask_prices:
-                self._ask_prices.remove(price)
-                #print(f"Removed {price} from ask prices.")
-        if price in self._levels:
-            del self._levels[price]
-            #print(f"Removed {price} from levels.")
-        if price in self._total_volumes:
-            del self._total_volumes[price]
-            #print(f"Removed {price} from total volumes.")
        
     def _best_bid(self):
         """Return the current best bid price"""
-        while self._bid_prices:
-            if self._levels[self._bid_prices[-1]]:
-                return self._bid_prices[-1]
-            else:
-                self._remove_level(self._bid_prices[-1], Side.BUY)
-        return None
+        tick = self._bids.best_tick()
+        return self.to_price(tick) if tick is not None else None
     
     def _best_ask(self):
         """Return the current best ask price"""
-        while self._ask_prices:
-            if self._levels[self._ask_prices[0]]:
-                return self._ask_prices[0]
-            else:
-                self._remove_level(self._ask_prices[0], Side.SELL)
-        return None
+        tick = self._asks.best_tick()
+        return self.to_price(tick) if tick is not None else None
 
     def mid_price(self):
         """Return the mid price of the order book"""
-        if self._best_bid() is None or self._best_ask() is None:
+        best_bid, best_ask = self._best_bid(), self._best_ask()
+        if best_bid is None or best_ask is None:
             return None
-        return (self._best_bid() + self._best_ask()) / 2.0
+        return (best_bid + best_ask) / 2.0
+    
+    def get_depth(self, side:Side, depth=10) -> np.ndarray:
+        """Return a (levels, 3) array of price, volume and order count for the best levels of a side.
+        
+        The array is maintained by the book and overwritten on later reads, copy it to keep it.
+        """
+        return self._ladder(side).depth(depth)
     
     def get_buy_side(self, depth=10):
-        buy_side:Dict[int, int] = {}
-        depth = min(depth, len(self._bid_prices)) if depth is not None else len(self._bid_prices)
-        for price in self._bid_prices[:depth]:
-            buy_side[price] = self._total_volumes[price]
-        return buy_side
+        """Return the best bids as a price -> volume dict, best first."""
+        return {price: volume for price, volume, _ in self._bids.depth(depth).tolist()}
     
     def get_sell_side(self, depth=10):
-        sell_side:Dict[int, int] = {}
-        depth = min(depth, len(self._ask_prices)) if depth is not None else len(self._ask_prices)
-        for price in self._ask_prices[:depth]:
-            sell_side[price] = self._total_volumes[price]
-        return sell_side
+        """Return the best asks as a price -> volume dict, best first."""
+        return {price: volume for price, volume, _ in self._asks.depth(depth).tolist()}
             
     
     def __str__(self, depth=None):
         bid_details = []
-        bid_depth = min(depth, len(self._bid_prices)) if depth is not None else len(self._bid_prices)
-        sorted_bid_prices = sorted(self._bid_prices, reverse=True)
-        for price in sorted_bid_prices[:bid_depth]:
-            orders = self._levels[price]
-            quantity_at_price = self._total_volumes[price]
-            order_count = len(orders)
-            bid_details.append(f"{price}$ x {quantity_at_price} (Orders: {order_count})")
+        for level in self._bids.levels_from_best(depth):
+            bid_details.append(f"{self.to_price(level.tick)}$ x {level.volume} (Orders: {len(level)})")
 
         ask_details = []
-        ask_depth = min(depth, len(self._ask_prices)) if depth is not None else len(self._ask_prices)
-        sorted_ask_prices = sorted(self._ask_prices)
-        for price in sorted_ask_prices[:ask_depth]:
-            orders = self._levels[price]
-            quantity_at_price = self._total_volumes[price]
-            order_count = len(orders)
-            ask_details.append(f"{price}$ x {quantity_at_price} (Orders: {order_count})")
+        for level in self._asks.levels_from_best(depth):
+            ask_details.append(f"{self.to_price(level.tick)}$ x {level.volume} (Orders: {len(level)})")
 
         bids_str = ' | '.join(bid_details) if bid_details else "No bids"
         asks_str = ' | '.join(ask_details) if ask_details else "No asks"
@@ -0,0 +1,221 @@
+from typing import Dict, Iterator, List, Optional
+import bisect
+
+import numpy as np
+
+from market_engine.order import Order
+from util.types import Side
+
+
+class OrderNode:
+    """ Link of a resting order in the FIFO queue of its price level """
+    __slots__ = ('order', 'level', 'prev', 'next')
+
+    def __init__(self, order:Order, level:'PriceLevel'):
+        self.order = order
+        self.level = level
+        self.prev: Optional[OrderNode] = None
+        self.next: Optional[OrderNode] = None
+
+
+class PriceLevel:
+    """ Resting orders at one price, in time priority, with their total volume
+
+    The queue is a doubly linked list of OrderNode so that an order can be unlinked from
+    anywhere in O(1) given its node.
+    """
+    __slots__ = ('tick', 'head', 'tail', 'count', 'volume')
+
+    def __init__(self, tick:int):
+        self.tick = tick
+        self.head: Optional[OrderNode] = None
+        self.tail: Optional[OrderNode] = None
+        self.count = 0
+        self.volume = 0
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.head is not None
+
+    def __iter__(self) -> Iterator[Order]:
+        node = self.head
+        while node is not None:
+            yield node.order
+            node = node.next
+
+    def append(self, order:Order) -> OrderNode:
+        node = OrderNode(order, self)
+        if self.tail is None:
+            self.head = node
+        else:
+            node.prev = self.tail
+            self.tail.next = node
+        self.tail = node
+        self.count += 1
+        return node
+
+    def unlink(self, node:OrderNode):
+        if node.prev is None:
+            self.head = node.next
+        else:
+            node.prev.next = node.next
+        if node.next is None:
+            self.tail = node.prev
+        else:
+            node.next.prev = node.prev
+        node.prev = node.next = None
+        self.count -= 1
+
+
+class SortedKeys:
+    """ Sorted integers kept as a list of sorted buckets of at most 2 * load keys
+
+    A key is found with a binary search over the bucket maxima then one inside its bucket, and an
+    insert or remove only shifts the keys of that bucket, so wide books do not pay for a shift of
+    every level as a single sorted list would. The largest key is the last one of the last bucket.
+    """
+
+    def __init__(self, load:int=256):
+        self._load = load
+        self._buckets: List[List[int]] = []
+        self._maxes: List[int] = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def last(self) -> int:
+        return self._buckets[-1][-1]
+
+    def add(self, key:int):
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            return
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            index -= 1
+        bucket = self._buckets[index]
+        bisect.insort(bucket, key)
+        self._maxes[index] = bucket[-1]
+        if len(bucket) > 2 * self._load:
+            self._buckets[index:index + 1] = [bucket[:self._load], bucket[self._load:]]
+            self._maxes[index:index + 1] = [bucket[self._load - 1], bucket[-1]]
+
+    def remove(self, key:int):
+        """ Remove a key known to be there """
+        index = bisect.bisect_left(self._maxes, key)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, key)]
+        self._len -= 1
+        if bucket:
+            self._maxes[index] = bucket[-1]
+        else:
+            del self._buckets[index], self._maxes[index]
+
+    def from_last(self, count:int) -> int:
+        """ count-th largest key, count=1 is the largest """
+        for bucket in reversed(self._buckets):
+            if count <= len(bucket):
+                return bucket[-count]
+            count -= len(bucket)
+        raise IndexError(count)
+
+    def largest(self, count:Optional[int]=None) -> List[int]:
+        """ The count largest keys (all of them by default), largest first """
+        keys = []
+        for bucket in reversed(self._buckets):
+            if count is not None and len(keys) + len(bucket) >= count:
+                keys.extend(reversed(bucket[len(bucket) - (count - len(keys)):]))
+                break
+            keys.extend(reversed(bucket))
+        return keys
+
+
+class PriceLadder:
+    """ Price levels of one side of the book, keyed by integer ticks
+
+    The keys are kept in SortedKeys so that the best price is always the largest key: ticks for bids,
+    negated ticks for asks. Top of book is O(1) and inserts/removes are binary searches whose shift is
+    bounded by the bucket size however many levels the book has.
+
+    The ladder also keeps a (view_depth, 3) array of price, volume and order count for the best
+    levels. Changes inside the top view_depth levels mark it stale and the next read refreshes it in
+    O(view_depth), changes further down the book cost nothing.
+    """
+
+    def __init__(self, side:Side, view_depth:int=10, ticks_per_unit:float=1):
+        self.side = side
+        self._sign = 1 if side == Side.BUY else -1
+        self._keys = SortedKeys()
+        self._levels: Dict[int, PriceLevel] = {}
+        self._ticks_per_unit = ticks_per_unit
+        self._view = np.zeros((view_depth, 3))
+        self._view_count = 0
+        self._view_stale = False
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __bool__(self):
+        return bool(self._keys)
+
+    def __contains__(self, tick:int):
+        return tick in self._levels
+
+    def best_tick(self) -> Optional[int]:
+        return self._sign * self._keys.last() if self._keys else None
+
+    def best_level(self) -> Optional[PriceLevel]:
+        return self._levels[self._sign * self._keys.last()] if self._keys else None
+
+    def get(self, tick:int) -> Optional[PriceLevel]:
+        return self._levels.get(tick)
+
+    def get_or_add(self, tick:int) -> PriceLevel:
+        level = self._levels.get(tick)
+        if level is None:
+            level = self._levels[tick] = PriceLevel(tick)
+            self._keys.add(self._sign * tick)
+            self.touch(tick)
+        return level
+
+    def remove(self, tick:int):
+        self.touch(tick)
+        del self._levels[tick]
+        self._keys.remove(self._sign * tick)
+
+    def touch(self, tick:int):
+        """ Record a change at a level, which only matters to the depth view if it is one of the best levels """
+        if not self._view_stale:
+            keys = self._keys
+            view_depth = len(self._view)
+            if len(keys) <= view_depth or self._sign * tick >= keys.from_last(view_depth):
+                self._view_stale = True
+
+    def depth(self, depth:Optional[int]=None) -> np.ndarray:
+        """ Return price, volume and order count of the best levels, best first
+
+        The array is reused and overwritten by later reads, copy it to keep it.
+        """
+        view_depth = len(self._view)
+        if depth is not None and depth > view_depth:
+            return np.array([(level.tick / self._ticks_per_unit, level.volume, level.count) for level in self.levels_from_best(depth)]).reshape(-1, 3)
+        if self._view_stale:
+            levels = self.levels_from_best(view_depth)
+            for i, level in enumerate(levels):
+                self._view[i] = (level.tick / self._ticks_per_unit, level.volume, level.count)
+            self._view_count = len(levels)
+            self._view_stale = False
+        count = self._view_count if depth is None else min(depth, self._view_count)
+        return self._view[:count]
+
+    def levels_from_best(self, depth:Optional[int]=None) -> List[PriceLevel]:
+        keys = self._keys.largest(depth) if depth is None or depth > 0 else []
+        return [self._levels[self._sign * key] for key in keys]
@@ -0,0 +1,228 @@
+from market_engine.order import Order, LimitOrder, MarketOrder
+from util.types import Side, MessageType
+from util.message import Message
+
+import copy
+import numpy as np
+import pandas as pd
+
+# Event kinds of the synthetic flow
+LIMIT, MARKET, CANCEL = 0, 1, 2
+
+
+class SyntheticOracle:
+    """ Oracle generating a random order flow instead of replaying recorded data
+
+    Time is cut into bins of bin_size. The number of events per bin is Poisson with a constant
+    intensity of arrival_rate per second, or follows a discretized Hawkes process with an exponential
+    kernel: the intensity is arrival_rate * (1 - hawkes_alpha) plus an excitation that jumps by
+    hawkes_alpha * hawkes_beta per event and decays at rate hawkes_beta, so the long run rate is still
+    arrival_rate and hawkes_alpha < 1 is the branching ratio. The log mid price is a random walk with
+    volatility per square root of a second. Each event is a limit order placed a geometric number of
+    ticks (mean placement_ticks) behind the mid, crossing the spread with probability cross_ratio, a market
+    order (market_ratio) or a cancel of one of the last cancel_window orders (cancel_ratio). Sizes are
+    lognormal rounded to size_decimals.
+
+    Events are generated with NumPy batch_bins bins at a time and, like a streaming DataOracle, only one
+    stream_window of them is in the kernel queue at once, so long runs with tens of millions of events
+    use constant memory. A seed of None draws one from np.random when the oracle starts, so that the
+    episodes seeded by Kernel.train see different flows.
+    """
+
+    def __init__(self, symbol:str, start_time="2024-01-01 00:00:00+00:00", duration=pd.Timedelta(hours=1), seed=7,
+                 arrival_rate:float=100.0, process:str="poisson", hawkes_alpha:float=0.5, hawkes_beta:float=2.0,
+                 mid_price:float=60000.0, volatility:float=0.0002, tick_size:float=0.01, placement_ticks:float=20.0,
+                 cross_ratio:float=0.02, market_ratio:float=0.05, cancel_ratio:float=0.3, cancel_window:int=1000,
+                 size_mean:float=-3.0, size_sigma:float=1.0, size_decimals:int=5,
+                 bin_size=pd.Timedelta(milliseconds=10), batch_bins:int=1000, streaming=True, stream_window=pd.Timedelta(seconds=1)):
+        if process not in ("poisson", "hawkes"):
+            raise ValueError(f"Unknown arrival process: {process}")
+        if process == "hawkes" and not 0 <= hawkes_alpha < 1:
+            raise ValueError(f"The Hawkes branching ratio must be in [0, 1), got {hawkes_alpha}")
+        if market_ratio + cancel_ratio > 1:
+            raise ValueError("market_ratio + cancel_ratio must not exceed 1")
+        self.symbol = symbol
+        self._start_time = pd.Timestamp(start_time)
+        self._duration = duration
+        self.seed = seed
+        self.process = process
+        self.arrival_rate = arrival_rate
+        self.hawkes_alpha = hawkes_alpha
+        self.hawkes_beta = hawkes_beta
+        self.mid_price = mid_price
+        self.volatility = volatility
+        self.tick_size = tick_size
+        self.placement_ticks = placement_ticks
+        self.cross_ratio = cross_ratio
+        self.kind_probabilities = [1 - market_ratio - cancel_ratio, market_ratio, cancel_ratio]
+        self.cancel_window = cancel_window
+        self.size_mean = size_mean
+        self.size_sigma = size_sigma
+        self.size_decimals = size_decimals
+        self._bin_ns = int(bin_size.value)
+        self._num_bins = int(np.ceil(duration.value / self._bin_ns))
+        self._batch_bins = batch_bins
+        self.streaming = streaming
+        self._stream_window = stream_window
+        self._reset()
+
+    def _reset(self):
+        """ Generator state, everything get_state/set_state need to carry on identically """
+        seed = self.seed if self.seed is not None else np.random.randint(2**31)
+        self._rng = np.random.default_rng(seed)
+        self._bin = 0  # next bin to generate
+        self._excitation = 0.0
+        self._log_mid = np.log(self.mid_price)
+        self._recent_ids = np.zeros(0, dtype=np.int64)
+        # Current batch, events before the cursor have been sent
+        self._batch = None
+        self._cursor = 0
+
+    def _arrivals(self, num_bins:int) -> np.ndarray:
+        dt = self._bin_ns / 1e9
+        if self.process == "poisson":
+            return self._rng.poisson(self.arrival_rate * dt, num_bins)
+        # The excitation is sequential, one draw per bin
+        baseline = self.arrival_rate * (1 - self.hawkes_alpha)
+        jump = self.hawkes_alpha * self.hawkes_beta
+        decay = np.exp(-self.hawkes_beta * dt)
+        poisson = self._rng.poisson
+        counts = np.empty(num_bins, dtype=np.int64)
+        excitation = self._excitation
+        for i in range(num_bins):
+            counts[i] = count = poisson((baseline + excitation) * dt)
+            excitation = decay * (excitation + jump * count)
+        self._excitation = excitation
+        return counts
+
+    def _next_batch(self) -> bool:
+        """ Generate the events of the next batch_bins bins, False once the duration is covered """
+        num_bins = min(self._batch_bins, self._num_bins - self._bin)
+        if num_bins <= 0:
+            return False
+        rng = self._rng
+        counts = self._arrivals(num_bins)
+        log_mids = self._log_mid + np.cumsum(rng.normal(0, self.volatility * np.sqrt(self._bin_ns / 1e9), num_bins))
+        self._log_mid = log_mids[-1]
+        bins = np.repeat(np.arange(num_bins), counts)
+        count = len(bins)
+
+        start_ns = self._start_time.value + self._bin * self._bin_ns
+        times = np.sort(start_ns + bins * self._bin_ns + (rng.random(count) * self._bin_ns).astype(np.int64))
+        kinds = rng.choice(3, size=count, p=self.kind_probabilities).astype(np.int8)
+        sides = rng.integers(0, 2, size=count).astype(np.int8)
+        mid_ticks = np.round(np.exp(log_mids[bins]) / self.tick_size).astype(np.int64)
+        offsets = rng.geometric(1 / self.placement_ticks, size=count)
+        crossing = rng.random(count) < self.cross_ratio
+        offsets[crossing] = -offsets[crossing]
+        # Buys sit below the mid and sells above it, a negative offset crosses the spread
+        ticks = np.where(sides == Side.BUY, mid_ticks - offsets, mid_ticks + offsets)
+        quantities = np.maximum(np.round(rng.lognormal(self.size_mean, self.size_sigma, count), self.size_decimals), 10.0 ** -self.size_decimals)
+
+        # Order ids are reserved from the shared counter so they never collide with the agents' ones
+        is_order = kinds != CANCEL
+        num_orders = int(is_order.sum())
+        first_id = Order.last_order_id + 1
+        Order.last_order_id += num_orders
+        issued = np.cumsum(is_order)
+        order_ids = np.where(is_order, first_id + issued - 1, -1)
+        # Cancels pick one of the last cancel_window orders issued before them, -1 if there is none yet
+        pool = np.concatenate([self._recent_ids, np.arange(first_id, first_id + num_orders, dtype=np.int64)])
+        available = len(self._recent_ids) + issued
+        lookback = (rng.random(count) * np.minimum(available, self.cancel_window)).astype(np.int64)
+        if len(pool):
+            targets = np.where(~is_order & (available > 0), pool[np.maximum(available - 1 - lookback, 0)], -1)
+        else:
+            targets = np.full(count, -1, dtype=np.int64)
+        self._recent_ids = pool[-self.cancel_window:]
+
+        self._bin += num_bins
+        self._batch = {
+            "times": times,
+            "kinds": kinds,
+            "sides": sides,
+            "prices": ticks * self.tick_size,
+            "quantities": quantities,
+            "order_ids": order_ids,
+            "targets": targets,
+        }
+        self._cursor = 0
+        return True
+
+    def _peek_time(self):
+        """ Time in nanoseconds of the next event to send, None when the flow is over """
+        while self._batch is None or self._cursor >= len(self._batch["times"]):
+            if not self._next_batch():
+                return None
+        return int(self._batch["times"][self._cursor])
+
+    def _messages(self, start:int, stop:int):
+        batch = self._batch
+        tz = self._start_time.tz
+        times = pd.to_datetime(batch["times"][start:stop], utc=True)
+        times = times.tz_convert(tz) if tz is not None else times.tz_localize(None)
+        rows = zip(times, batch["kinds"][start:stop].tolist(), batch["sides"][start:stop].tolist(), batch["prices"][start:stop].tolist(),
+                   batch["quantities"][start:stop].tolist(), batch["order_ids"][start:stop].tolist(), batch["targets"][start:stop].tolist())
+        for time, kind, side, price, quantity, order_id, target in rows:
+            if kind == LIMIT:
+                yield time, Message(MessageType.LIMIT_ORDER, LimitOrder("Market", time, self.symbol, quantity, Side(side), price, order_id))
+            elif kind == MARKET:
+                yield time, Message(MessageType.MARKET_ORDER, MarketOrder("Market", time, self.symbol, quantity, Side(side), order_id))
+            elif target >= 0:
+                yield time, Message(MessageType.CANCEL_ORDER, {"order_id": target, "symbol": self.symbol, "agent_id": "Market"})
+
+    def send_events(self, horizon_ns:int):
+        """ Schedule every event up to horizon_ns (included) for delivery at its time """
+        exchange_id = self.kernel.get_exchange_id()
+        current_time = self.kernel.get_current_time()
+        next_ns = self._peek_time()
+        while next_ns is not None and next_ns <= horizon_ns:
+            times = self._batch["times"]
+            stop = int(np.searchsorted(times, horizon_ns, side="right"))
+            for time, message in self._messages(self._cursor, stop):
+                self.kernel.send_message("", exchange_id, message, time - current_time)
+            self._cursor = stop
+            next_ns = self._peek_time()
+        return next_ns
+
+    def stream_orders(self, current_time):
+        """ Send the events falling within one stream window of current_time """
+        next_ns = self.send_events((current_time + self._stream_window).value)
+        # Wake up again when the next event enters the window, but at most twice per window since events are not grouped by timestamp
+        if next_ns is not None:
+            next_time = pd.Timestamp(next_ns, tz="UTC")
+            next_time = next_time.tz_convert(self._start_time.tz) if self._start_time.tz is not None else next_time.tz_localize(None)
+            self.kernel.schedule_timer(self.stream_orders, start_time=max(next_time - self._stream_window, current_time + self._stream_window / 2))
+
+    def get_start_time(self):
+        return self._start_time
+
+    def get_end_time(self):
+        return self._start_time + self._duration
+
+    def get_state(self):
+        """ Generator position and random state, the current batch is copied so that the oracle can carry on """
+        return copy.deepcopy({
+            "rng": self._rng.bit_generator.state,
+            "_bin": self._bin,
+            "_excitation": self._excitation,
+            "_log_mid": self._log_mid,
+            "_recent_ids": self._recent_ids,
+            "_batch": self._batch,
+            "_cursor": self._cursor,
+        })
+
+    def set_state(self, state):
+        state = copy.deepcopy(state)
+        self._rng.bit_generator.state = state.pop("rng")
+        self.__dict__.update(state)
+
+    def kernel_init(self, kernel):
+        self.kernel = kernel
+
+    def kernel_start(self, start_time):
+        self._reset()
+        if self.streaming:
+            self.stream_orders(start_time)
+        else:
+            self.send_events(self.get_end_time().value)
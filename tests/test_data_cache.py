@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+
+from benchmarks.flows import synthetic_snapshots
+from market_engine.data_cache import MarketDataCache
+from market_engine.data_oracle import DataOracle
+
+
+def _orders(oracle, timestamp):
+    return [(order.order_id, order.side) for order in oracle.get_orders(timestamp)]
+
+
+def _amounts(oracle, timestamp):
+    return [(order.limit_price, order.quantity) for order in oracle.get_orders(timestamp)]
+
+
+def test_cached_columns_replay_the_same_orders(tmp_path):
+    data = synthetic_snapshots(200, levels=5)
+    path = str(tmp_path / "snapshots.csv")
+    data.to_csv(path, index=False)
+    cache = MarketDataCache(str(tmp_path / "cache"))
+    cached = DataOracle.from_cache(cache, path, "BTC")
+    direct = DataOracle(data, "BTC")
+    direct.read_data()
+    assert cached.get_timestamps().equals(direct.get_timestamps())
+    for timestamp in direct.get_timestamps():
+        assert _orders(cached, timestamp) == _orders(direct, timestamp)
+        # cached prices and volumes are integer ticks and lots scaled back
+        assert np.allclose(_amounts(cached, timestamp), _amounts(direct, timestamp), rtol=1e-12, atol=0)
+
+
+def test_changed_sources_replace_their_entry_and_keep_others(tmp_path):
+    cache = MarketDataCache(str(tmp_path / "cache"))
+    for directory in ("a", "b"):
+        os.makedirs(tmp_path / directory)
+        synthetic_snapshots(40, levels=2, seed=0).to_csv(tmp_path / directory / "data.csv", index=False)
+        cache.load(str(tmp_path / directory / "data.csv"))
+    entries = sorted(os.listdir(tmp_path / "cache"))
+    assert len(entries) == 2
+    # loading again reuses the entries
+    cache.load(str(tmp_path / "a" / "data.csv"))
+    assert sorted(os.listdir(tmp_path / "cache")) == entries
+    synthetic_snapshots(40, levels=2, seed=1).to_csv(tmp_path / "a" / "data.csv", index=False)
+    columns = cache.load(str(tmp_path / "a" / "data.csv"))
+    after = sorted(os.listdir(tmp_path / "cache"))
+    assert len(after) == 2 and len(set(after) & set(entries)) == 1
+    assert columns["source_hash"] == cache.file_hash(str(tmp_path / "a" / "data.csv"))
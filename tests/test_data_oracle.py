@@ -0,0 +1,32 @@
+import random
+
+import pandas as pd
+
+from agents.dummy_trader import DummyTrader
+from agents.exchange_agent import ExchangeAgent
+from benchmarks.flows import synthetic_snapshots
+from kernel import Kernel
+from market_engine.data_oracle import DataOracle
+from market_engine.order import Order
+from util.types import Side
+
+
+def _run(streaming):
+    random.seed(0)
+    Order.last_order_id = 0
+    oracle = DataOracle(synthetic_snapshots(400, levels=10), "BTC", streaming=streaming, stream_window=pd.Timedelta(seconds=3))
+    oracle.read_data()
+    kernel = Kernel()
+    kernel.pre_run(oracle, ExchangeAgent("exchange_agent", "BTC"), DummyTrader("dummy_agent"))
+    queued = len(kernel._messages)
+    kernel.resume()
+    kernel.stop()
+    book = kernel.get_agent("exchange_agent").get_order_book()
+    return queued, kernel.get_agent("dummy_agent").get_results()["cash"], book.get_depth(Side.BUY, 5).tolist()
+
+
+def test_orders_are_built_when_their_timestamp_comes_up():
+    queued, cash, depth = _run(streaming=False)
+    # one delivery event for the 20 snapshots instead of their 400 orders
+    assert queued < 20
+    assert (cash, depth) == _run(streaming=True)[1:]
@@ -0,0 +1,22 @@
+from util.event_calendar import EventCalendar
+
+
+def test_events_come_out_by_time_then_insertion_order():
+    calendar = EventCalendar()
+    for time, name in [(3, "c"), (1, "a1"), (2, "b"), (1, "a2"), (3, "d"), (1, "a3")]:
+        calendar.push(time, name, None)
+    assert len(calendar) == 6
+    assert calendar.peek_time() == 1
+    assert [recipient for recipient, _ in calendar.pop_due(1)] == ["a1", "a2", "a3"]
+    assert calendar.pop() == (2, "b", None)
+    assert [recipient for recipient, _ in calendar.pop_due(10)] == ["c", "d"]
+    assert calendar.empty() and calendar.peek_time() is None
+
+
+def test_pop_due_leaves_later_events_queued():
+    calendar = EventCalendar()
+    calendar.push(5, "later", None)
+    calendar.push(2, "due", None)
+    assert calendar.pop_due(4) == [("due", None)]
+    assert calendar.pop_due(4) == []
+    assert calendar.peek_time() == 5
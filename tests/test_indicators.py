@@ -0,0 +1,19 @@
+import math
+import warnings
+
+from market_engine.indicators import RollingSum
+
+
+def test_rolling_sum_recovers_once_a_non_finite_value_leaves_the_window():
+    rolling = RollingSum(3)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        for value in (1.0, math.inf, 2.0):
+            rolling.add(value)
+        assert rolling.total == math.inf
+        rolling.add(-math.inf)
+        assert math.isnan(rolling.total)
+        for value in (3.0, 4.0, 5.0):
+            rolling.add(value)
+    assert rolling.total == 12.0
+    assert rolling.add(6.0) == 15.0
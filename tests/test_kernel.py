@@ -0,0 +1,63 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+from agents.dummy_trader import DummyTrader
+from agents.exchange_agent import ExchangeAgent
+from kernel import Kernel
+from market_engine.composite_oracle import CompositeOracle
+from market_engine.order import Order
+from market_engine.synthetic_oracle import SyntheticOracle
+
+SYMBOLS = ["S0", "S1", "S2"]
+
+
+def _sharded_kernel(num_shards):
+    Order.last_order_id = 0
+    oracle = CompositeOracle([SyntheticOracle(symbol, duration=pd.Timedelta(seconds=10), seed=i) for i, symbol in enumerate(SYMBOLS)])
+    kernel = Kernel()
+    kernel.pre_run(oracle, ExchangeAgent("exchange_agent", SYMBOLS, num_shards=num_shards), DummyTrader("dummy_agent", symbol="S1"))
+    return kernel
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_sharded_fork_rollouts_match_single_book_process():
+    results = {}
+    for num_shards in (1, 2):
+        kernel = _sharded_kernel(num_shards)
+        kernel.step_until(pd.Timestamp("2024-01-01 00:00:05+00:00"))
+        rollouts = kernel.fork_rollouts(num_rollouts=3, seed=1)
+        # the parent carries on from the same state once the rollouts are done
+        kernel.resume()
+        kernel.stop()
+        results[num_shards] = [rollout["cash"] for rollout in rollouts], kernel.get_agent("dummy_agent").get_results()["cash"]
+    rollouts, final = results[2]
+    assert rollouts == results[1][0]
+    assert rollouts == [final] * 3
+    assert final == results[1][1]
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_sharded_exchange_matches_single_book_process():
+    results = []
+    for num_shards in (1, 2, 3):
+        kernel = _sharded_kernel(num_shards)
+        kernel.resume()
+        kernel.stop()
+        exchange = kernel.get_agent("exchange_agent")
+        books = {symbol: (exchange.get_order_book(symbol).get_buy_side(), exchange.get_order_book(symbol).get_sell_side()) for symbol in SYMBOLS}
+        history = {symbol: exchange.get_market_analytics(symbol).history.mid_prices.tolist() for symbol in SYMBOLS}
+        results.append((kernel.get_agent("dummy_agent").get_results(), books, str(history)))
+    # shards send their depths at the end of the time slice of an analytics tick, a single process reads them at the
+    # tick, so only the analytics of sharded runs match each other
+    assert results[0][:2] == results[1][:2] == results[2][:2]
+    assert results[1][2] == results[2][2]
+
+
+def test_run_stops_the_shard_processes():
+    kernel = _sharded_kernel(2)
+    kernel.resume()
+    kernel.stop()
+    assert not multiprocessing.active_children()
+    assert kernel.get_agent("exchange_agent").get_order_book("S2") is not None
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from market_engine.market_analytics import MarketAnalytics
+from market_engine.order import LimitOrder
+from market_engine.order_book import OrderBook
+from util.types import Side
+
+
+class Outbox:
+    def send_message(self, recipient_id, message):
+        pass
+
+
+def _analytics():
+    book = OrderBook("BTC", Outbox())
+    book.send_order(LimitOrder("maker", 0, "BTC", 1.0, Side.BUY, 100.0))
+    book.send_order(LimitOrder("maker", 0, "BTC", 1.0, Side.SELL, 100.02))
+    analytics = MarketAnalytics("BTC", depth=5)
+    analytics.update(pd.Timestamp("2024-01-01", tz="UTC"), book)
+    return analytics
+
+
+def test_view_windows_cannot_change_the_shared_history():
+    analytics = _analytics()
+    view = analytics.view()
+    window = view.window(1)
+    for name, array in window.items():
+        with pytest.raises(ValueError):
+            array[...] = 0
+    with pytest.raises(ValueError):
+        view.last_prices(1)[0] = 0
+    assert analytics.view().best_bid() == (100.0, 1.0)
+    assert np.array_equal(analytics.view().window(1)['bid_prices'], window['bid_prices'], equal_nan=True)
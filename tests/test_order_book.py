@@ -0,0 +1,99 @@
+import pickle
+
+from market_engine.order import LimitOrder, MarketOrder
+from market_engine.order_book import OrderBook
+from util.types import MessageType, Side
+
+
+class Outbox:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, recipient_id, message):
+        self.messages.append((recipient_id, message))
+
+
+def _limit(agent_id, side, price, quantity=1.0):
+    return LimitOrder(agent_id, 0, "BTC", quantity, side, price)
+
+
+def _executions(book):
+    """ (agent, order_id, side, quantity, price) of every fill reported so far """
+    return [(recipient, *fill[:4]) for recipient, message in book.owner.messages if message.type == MessageType.ORDER_EXECUTED
+            for fill in zip(message.content.order_ids.tolist(), message.content.sides.tolist(),
+                            message.content.quantities.tolist(), message.content.prices.tolist())]
+
+
+def test_orders_match_best_price_first_then_time():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    early, late, worse = _limit("a", Side.SELL, 100.0, 1.0), _limit("b", Side.SELL, 100.0, 1.0), _limit("c", Side.SELL, 100.5, 1.0)
+    for order in (worse, early, late):
+        book.send_order(order)
+    taker = _limit("t", Side.BUY, 101.0, 2.5)
+    book.send_order(taker)
+    fills = _executions(book)
+    assert [fill for fill in fills if fill[0] != "t"] == [
+        ("a", early.order_id, Side.SELL, 1.0, 100.0), ("b", late.order_id, Side.SELL, 1.0, 100.0), ("c", worse.order_id, Side.SELL, 0.5, 100.5)]
+    assert [fill for fill in fills if fill[0] == "t"] == [
+        ("t", taker.order_id, Side.BUY, 1.0, 100.0), ("t", taker.order_id, Side.BUY, 1.0, 100.0), ("t", taker.order_id, Side.BUY, 0.5, 100.5)]
+    # the taker was filled in full, the rest of the worse ask still rests
+    assert book.get_order(taker.order_id) is None
+    assert book.get_sell_side() == {100.5: 0.5}
+    assert book.get_buy_side() == {}
+
+
+def test_market_orders_stop_when_the_book_is_empty():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    book.send_order(_limit("a", Side.BUY, 99.0, 1.0))
+    book.send_order(MarketOrder("t", 0, "BTC", 3.0, Side.SELL))
+    assert [fill[3] for fill in _executions(book)] == [1.0, 1.0]
+    assert not book.get_buy_side()
+
+
+def test_only_the_owner_cancels_or_modifies_an_order():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    first, second = _limit("a", Side.BUY, 100.0, 2.0), _limit("b", Side.BUY, 100.0, 1.0)
+    book.send_order(first)
+    book.send_order(second)
+    assert book.cancel_order(first.order_id, "b") is None
+    assert book.modify_order(first.order_id, 1.0, "b") is None
+    assert book.get_buy_side() == {100.0: 3.0}
+    # a reduction keeps the queue position, an increase is ignored
+    assert book.modify_order(first.order_id, 1.0, "a") is first
+    assert book.modify_order(first.order_id, 5.0, "a") is None
+    assert book.get_buy_side() == {100.0: 2.0}
+    book.send_order(_limit("t", Side.SELL, 100.0, 1.0))
+    assert _executions(book)[0][:2] == ("a", first.order_id)
+    # a modify down to zero removes the order, after which it cannot be cancelled again
+    assert book.modify_order(second.order_id, 0, "b") is second
+    assert book.cancel_order(second.order_id, "b") is None
+    assert book.get_buy_side() == {}
+
+
+def test_off_tick_limit_prices_never_cross_their_limit():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    book.send_order(_limit("seller", Side.SELL, 100.01))
+    book.send_order(_limit("buyer", Side.BUY, 100.006))
+    assert book.owner.messages == []
+    assert book.get_depth(Side.BUY, 1)[0, 0] == 100.00
+    book.send_order(_limit("seller", Side.SELL, 100.004))
+    assert book.get_depth(Side.SELL, 1)[0, 0] == 100.01
+
+
+def test_on_tick_prices_keep_their_tick_despite_float_noise():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    for price in (0.07, 100.01, 62688.21):
+        assert book.to_ticks(price, Side.BUY) == book.to_ticks(price, Side.SELL) == round(price * 100)
+
+
+def test_get_order_is_the_resting_order_and_pickles_keep_the_queues():
+    book = OrderBook("BTC", Outbox(), tick_size=0.01)
+    first, second = _limit("a", Side.BUY, 100.0, 2.0), _limit("b", Side.BUY, 100.0, 1.0)
+    book.send_order(first)
+    book.send_order(second)
+    book.send_order(_limit("c", Side.SELL, 100.0, 0.5))
+    assert book.get_order(first.order_id) is first
+    assert first.remaining_quantity == 1.5
+    copy = pickle.loads(pickle.dumps(book))
+    assert [order.order_id for order in copy._bids.best_level()] == [first.order_id, second.order_id]
+    assert copy.get_depth(Side.BUY, 1).tolist() == book.get_depth(Side.BUY, 1).tolist() == [[100.0, 2.5, 2]]
@@ -0,0 +1,36 @@
+import bisect
+import random
+
+from market_engine.price_ladder import PriceLadder, SortedKeys
+from util.types import Side
+
+
+def test_sorted_keys_match_a_sorted_list_across_bucket_splits():
+    keys, reference = SortedKeys(load=4), []
+    rng = random.Random(0)
+    for _ in range(3000):
+        key = rng.randrange(200)
+        if key in reference:
+            keys.remove(key)
+            reference.remove(key)
+        else:
+            keys.add(key)
+            bisect.insort(reference, key)
+        assert len(keys) == len(reference)
+        if reference:
+            assert keys.last() == reference[-1]
+            count = rng.randint(1, len(reference))
+            assert keys.from_last(count) == reference[-count]
+            assert keys.largest(count) == reference[::-1][:count]
+    assert keys.largest() == reference[::-1]
+
+
+def test_wide_ladders_keep_the_best_levels_in_order():
+    asks = PriceLadder(Side.SELL, view_depth=3)
+    for tick in random.Random(1).sample(range(100, 5000), 2000):
+        asks.get_or_add(tick)
+    best = sorted(tick for tick in range(100, 5000) if tick in asks)[:5]
+    assert asks.best_tick() == best[0]
+    assert [level.tick for level in asks.levels_from_best(5)] == best
+    asks.remove(best[0])
+    assert asks.depth()[:, 0].tolist() == best[1:4]
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from agents.trading_agent import TradingAgent
+from kernel import Kernel
+from market_engine.order import ExecutionReport
+from util.message import Message
+from util.types import MessageType, Side
+
+
+def _report(fills):
+    return Message(MessageType.ORDER_EXECUTED, ExecutionReport("trader", "BTC", fills))
+
+
+def test_fills_are_kept_as_running_totals():
+    agent = TradingAgent("trader", starting_cash=1000)
+    agent.kernel_init(Kernel())
+    now = pd.Timestamp("2024-01-01", tz="UTC")
+    agent.receive_message(now, _report([(1, Side.BUY, 2.0, 10.0, 0.5), (2, Side.BUY, 1.0, 11.0, 0.0)]))
+    agent.receive_message(now, _report([(3, Side.SELL, 1.5, 12.0, -0.25)]))
+    results = agent.get_results()
+    assert results["fills"] == {"BTC": {"fills": 3, "bought": 3.0, "sold": 1.5, "buy_notional": 31.0,
+                                        "sell_notional": 18.0, "fees": 0.25}}
+    assert results["cash"] == 1000 - 31.0 + 18.0 + 0.25
+    assert results["positions"] == {"BTC": 1.5}
+    assert not hasattr(agent, "_fills")
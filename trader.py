@@ -104,6 +104,9 @@ class VolumeBasedTrader:
     # hyperparameters
     # deviation nbr tick from BB BA devTick
     # k measure of imbalance
+    dev_tick = 1
+    kappa = 1/3
+    
     def set_hyperparameter(self, d:dict):
         self.dev_tick = 1
         self.kappa = 1/3
@@ -124,7 +127,8 @@ class VolumeBasedTrader:
             if volume_ask == 0 and volume_bid == 0:
                 break
             v_imbalance = (volume_bid - volume_ask) / (volume_bid + volume_ask)
-            if v_imbalance > self.kappa:
+            # a one-sided book has no price to quote from on the empty side, its regime sends nothing
+            if v_imbalance > self.kappa and len(sell_orders) != 0:
                 # buy heavy regime
                 acceptable_price = list(sell_orders.keys())[0] + 1
                 qty = - 20 - pos
@@ -132,7 +136,7 @@ class VolumeBasedTrader:
             elif self.kappa > v_imbalance > - self.kappa:
                 # neutral regime
                 pass
-            elif v_imbalance <= -self.kappa:
+            elif v_imbalance <= -self.kappa and len(buy_orders) != 0:
                 # sell heavy regime
                 acceptable_price = list(buy_orders.keys())[0] -1
                 qty = 20 - pos
@@ -0,0 +1,53 @@
+from typing import Any, List, Optional, Tuple
+import heapq
+
+
+class EventCalendar:
+    """ Single-threaded event calendar ordered by (time, sequence) """
+
+    def __init__(self):
+        self._heap: List[Tuple[Any, int, str, Any]] = []
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __bool__(self):
+        return bool(self._heap)
+
+    def empty(self):
+        return not self._heap
+
+    def push(self, time, recipient:str, message):
+        """ Schedule a message for a recipient, ties are broken by insertion order """
+        heapq.heappush(self._heap, (time, self._sequence, recipient, message))
+        self._sequence += 1
+
+    def peek_time(self) -> Optional[Any]:
+        """ Return the time of the next event without removing it """
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self) -> Tuple[Any, str, Any]:
+        time, _, recipient, message = heapq.heappop(self._heap)
+        return time, recipient, message
+
+    def pop_due(self, time) -> List[Tuple[str, Any]]:
+        """ Remove and return every (recipient, message) scheduled at or before time, in order """
+        heap = self._heap
+        due = []
+        while heap and heap[0][0] <= time:
+            _, _, recipient, message = heapq.heappop(heap)
+            due.append((recipient, message))
+        return due
+
+
+class Timer:
+    """ Callback scheduled as an ordinary calendar event, rescheduled every interval if one is given """
+
+    def __init__(self, callback, interval=None):
+        self.callback = callback
+        self.interval = interval
+        self.active = True
+
+    def cancel(self):
+        self.active = False
@@ -0,0 +1,140 @@
+from typing import Dict, Optional, Tuple
+from collections import defaultdict
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+# Latencies are bucketed by power of two nanoseconds, bucket b holds latencies in [2^(b-1), 2^b)
+HISTOGRAM_BUCKETS = 48
+
+
+class HandlerStats:
+    """ Call count, total and maximum latency and log2 latency histogram of one handler """
+    __slots__ = ('count', 'total_ns', 'max_ns', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = np.zeros(HISTOGRAM_BUCKETS, dtype=np.int64)
+
+    def add(self, elapsed_ns:int):
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.histogram[min(elapsed_ns.bit_length(), HISTOGRAM_BUCKETS - 1)] += 1
+
+    def quantile(self, q:float) -> int:
+        """ Upper bound in nanoseconds of the bucket holding the q-quantile """
+        if not self.count:
+            return 0
+        bucket = int(np.searchsorted(np.cumsum(self.histogram), q * self.count))
+        return 1 << bucket
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "total_ms": self.total_ns / 1e6,
+            "mean_us": self.total_ns / self.count / 1e3 if self.count else 0.0,
+            "p50_us": self.quantile(0.5) / 1e3,
+            "p99_us": self.quantile(0.99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+        }
+
+
+class KernelStats:
+    """ Where the simulation time of a kernel goes
+
+    Counts and times every delivered message per (agent, message type) and every timer per callback,
+    samples the calendar length every queue_sample_interval of simulated time and compares the wall
+    clock with the simulated clock between start and stop.
+    """
+
+    def __init__(self, queue_sample_interval=pd.Timedelta(seconds=1)):
+        self.handlers: Dict[Tuple[str, str], HandlerStats] = defaultdict(HandlerStats)
+        self.queue_sample_interval = queue_sample_interval
+        self.queue_times = []
+        self.queue_depths = []
+        self._next_sample = None
+        self._wall_ns = 0
+        self._sim_time = pd.Timedelta(0)
+        self._started = None
+
+    def start(self, sim_time):
+        self._started = (time.perf_counter_ns(), sim_time)
+        if self._next_sample is None:
+            self._next_sample = sim_time
+
+    def stop(self, sim_time):
+        if self._started is None:
+            return
+        wall_start, sim_start = self._started
+        self._wall_ns += time.perf_counter_ns() - wall_start
+        self._sim_time += sim_time - sim_start
+        self._started = None
+
+    def sample_queue(self, sim_time, depth:int):
+        if self._next_sample is not None and sim_time >= self._next_sample:
+            self.queue_times.append(sim_time)
+            self.queue_depths.append(depth)
+            self._next_sample = sim_time + self.queue_sample_interval
+
+    def record(self, agent:str, kind:str, elapsed_ns:int):
+        self.handlers[(agent, kind)].add(elapsed_ns)
+
+    @property
+    def events(self) -> int:
+        return sum(stats.count for stats in self.handlers.values())
+
+    def counts_by_agent(self) -> Dict[str, int]:
+        counts = defaultdict(int)
+        for (agent, _), stats in self.handlers.items():
+            counts[agent] += stats.count
+        return dict(counts)
+
+    def counts_by_type(self) -> Dict[str, int]:
+        counts = defaultdict(int)
+        for (_, kind), stats in self.handlers.items():
+            counts[kind] += stats.count
+        return dict(counts)
+
+    def to_frame(self) -> pd.DataFrame:
+        """ One row per (agent, message type or timer callback), slowest handlers first """
+        rows = [{"agent": agent, "kind": kind, **stats.summary()} for (agent, kind), stats in self.handlers.items()]
+        frame = pd.DataFrame(rows, columns=["agent", "kind", "count", "total_ms", "mean_us", "p50_us", "p99_us", "max_us"])
+        return frame.sort_values("total_ms", ascending=False, ignore_index=True)
+
+    def queue_depth(self) -> pd.Series:
+        return pd.Series(self.queue_depths, index=pd.DatetimeIndex(self.queue_times), name="queue_depth", dtype=np.int64)
+
+    def report(self) -> Dict:
+        wall_seconds = self._wall_ns / 1e9
+        sim_seconds = self._sim_time.total_seconds()
+        events = self.events
+        return {
+            "events": events,
+            "wall_seconds": wall_seconds,
+            "sim_seconds": sim_seconds,
+            "events_per_second": events / wall_seconds if wall_seconds else None,
+            "sim_seconds_per_wall_second": sim_seconds / wall_seconds if wall_seconds else None,
+            "max_queue_depth": max(self.queue_depths) if self.queue_depths else 0,
+            "events_by_agent": self.counts_by_agent(),
+            "events_by_type": self.counts_by_type(),
+            "handlers": [{**row, "histogram": self.handlers[(row["agent"], row["kind"])].histogram.tolist()}
+                         for row in self.to_frame().to_dict("records")],
+            "queue_depth": [[str(sim_time), depth] for sim_time, depth in zip(self.queue_times, self.queue_depths)],
+        }
+
+    def export(self, path:str):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def __str__(self):
+        report = self.report()
+        rate = report["events_per_second"] or 0
+        speed = report["sim_seconds_per_wall_second"] or 0
+        return (f"KernelStats: {report['events']} events in {report['wall_seconds']:.3f}s wall "
+                f"({rate:.0f} events/s, {speed:.1f}x real time), max queue depth {report['max_queue_depth']}")
@@ -0,0 +1,190 @@
+from typing import Dict, Iterable, List, Optional
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Record layout of each journal category, times are int64 nanoseconds and strings are codes into the journal's string table
+ORDER_KINDS = ("LIMIT", "MARKET", "CANCEL", "MODIFY")
+CATEGORIES = {
+    "orders": np.dtype([("time", np.int64), ("agent", np.int32), ("order_id", np.int64), ("kind", np.int8),
+                        ("side", np.int8), ("price", np.float64), ("quantity", np.float64)]),
+    "fills": np.dtype([("time", np.int64), ("agent", np.int32), ("order_id", np.int64), ("side", np.int8),
+                       ("price", np.float64), ("quantity", np.float64), ("fee", np.float64)]),
+    "book": np.dtype([("time", np.int64), ("symbol", np.int32), ("bid_price", np.float64), ("bid_volume", np.float64),
+                      ("ask_price", np.float64), ("ask_volume", np.float64), ("mid_price", np.float64)]),
+    "agent_state": np.dtype([("time", np.int64), ("agent", np.int32), ("symbol", np.int32), ("cash", np.float64),
+                             ("position", np.float64), ("pending_position", np.float64)]),
+}
+
+
+class JournalChannel:
+    """ Records of one category, written into a fixed-size block handed to the writer thread when full """
+
+    def __init__(self, name:str, dtype:np.dtype, writer:'JournalWriter', block_size:int):
+        self.name = name
+        self.dtype = dtype
+        self._writer = writer
+        self._block = np.empty(block_size, dtype=dtype)
+        self._count = 0
+
+    def record(self, *fields):
+        self._block[self._count] = fields
+        self._count += 1
+        if self._count == len(self._block):
+            self.flush()
+
+    def record_many(self, columns:Dict[str, object], length:int):
+        """ Record length rows at once from arrays or scalars per field """
+        rows = np.empty(length, dtype=self.dtype)
+        for field, values in columns.items():
+            rows[field] = values
+        start = 0
+        while start < length:
+            count = min(length - start, len(self._block) - self._count)
+            self._block[self._count:self._count + count] = rows[start:start + count]
+            self._count += count
+            start += count
+            if self._count == len(self._block):
+                self.flush()
+
+    def flush(self):
+        if self._count:
+            # The full block goes to the writer as is and recording carries on in a fresh one
+            self._writer.submit(self.name, self._block[:self._count])
+            self._block = np.empty(len(self._block), dtype=self.dtype)
+            self._count = 0
+
+
+class JournalWriter(threading.Thread):
+    """ Background thread appending record blocks to one binary file per category """
+
+    def __init__(self, directory:str):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self._queue = queue.Queue()
+        self._files = {}
+
+    def submit(self, name:str, block:np.ndarray):
+        self._queue.put((name, block))
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                name, block = item
+                file = self._files.get(name)
+                if file is None:
+                    file = self._files[name] = open(os.path.join(self.directory, f"{name}.bin"), "ab")
+                block.tofile(file)
+                file.flush()
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        self._queue.join()
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+
+class Journal:
+    """ Structured binary journal of simulation events
+
+    Each enabled category (see CATEGORIES) is an attribute holding a JournalChannel, disabled ones are
+    None so that call sites skip them with a single check and build nothing. Records are buffered in
+    blocks of block_size rows and written by a background thread to <directory>/<category>.bin, the
+    layouts and string table go to meta.json. Use read_journal to load a category as a DataFrame.
+    Without a directory every category is disabled. Copies and pickles of a journal are disabled.
+    """
+
+    def __init__(self, directory:Optional[str]=None, categories:Iterable[str]=tuple(CATEGORIES), block_size:int=65536):
+        self.directory = directory
+        self._strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._writer = None
+        self.orders = self.fills = self.book = self.agent_state = None
+        if directory is None:
+            return
+        unknown = set(categories) - set(CATEGORIES)
+        if unknown:
+            raise ValueError(f"Unknown journal categories: {sorted(unknown)}")
+        os.makedirs(directory, exist_ok=True)
+        for name in CATEGORIES:
+            path = os.path.join(directory, f"{name}.bin")
+            if os.path.exists(path):
+                os.remove(path)
+        self._writer = JournalWriter(directory)
+        self._writer.start()
+        for name in categories:
+            setattr(self, name, JournalChannel(name, CATEGORIES[name], self._writer, block_size))
+
+    def __reduce__(self):
+        return (Journal, ())
+
+    @property
+    def enabled(self) -> bool:
+        return self._writer is not None
+
+    def code(self, string:str) -> int:
+        """ Code of a string (agent id, symbol) in the string table """
+        code = self._codes.get(string)
+        if code is None:
+            code = self._codes[string] = len(self._strings)
+            self._strings.append(string)
+        return code
+
+    def channels(self) -> List[JournalChannel]:
+        return [channel for channel in (self.orders, self.fills, self.book, self.agent_state) if channel is not None]
+
+    def flush(self):
+        """ Hand every buffered record to the writer and wait until it is on disk """
+        if self._writer is None:
+            return
+        for channel in self.channels():
+            channel.flush()
+        self._writer.wait()
+        meta = {
+            "strings": self._strings,
+            "order_kinds": ORDER_KINDS,
+            "categories": {channel.name: channel.dtype.descr for channel in self.channels()},
+        }
+        with open(os.path.join(self.directory, "meta.json"), "w") as file:
+            json.dump(meta, file)
+
+    def close(self):
+        if self._writer is None:
+            return
+        self.flush()
+        self._writer.stop()
+        self._writer = None
+        self.orders = self.fills = self.book = self.agent_state = None
+
+
+def read_journal(directory:str, category:str) -> pd.DataFrame:
+    """ Load the records of a category written by a Journal, with times as timestamps and codes as strings """
+    with open(os.path.join(directory, "meta.json")) as file:
+        meta = json.load(file)
+    if category not in meta["categories"]:
+        raise ValueError(f"Category {category} was not journaled in {directory}")
+    dtype = np.dtype([tuple(field) for field in meta["categories"][category]])
+    path = os.path.join(directory, f"{category}.bin")
+    records = np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.empty(0, dtype=dtype)
+    frame = pd.DataFrame(records)
+    frame["time"] = pd.to_datetime(frame["time"], utc=True)
+    strings = np.array(meta["strings"], dtype=object)
+    for column in ("agent", "symbol"):
+        if column in frame:
+            frame[column] = strings[frame[column].to_numpy()] if len(strings) else frame[column].astype(object)
+    if "kind" in frame:
+        frame["kind"] = np.array(meta["order_kinds"], dtype=object)[frame["kind"].to_numpy()]
+    return frame
@@ -1,5 +1,11 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+
+# Listener writing the queued records of the current logger to its file
+_listener = None
 
 def setup_logger(log_filename='test.log'):
     log_directory = 'logs'
@@ -13,16 +19,33 @@ def setup_logger(log_filename='test.log'):
     #formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     formatter = logging.Formatter('%(asctime)s - %(message)s')
 
+    global _listener
     if logger.handlers:
         logger.handlers = []  # clear existing handlers
+    if _listener is not None:
+        _listener.stop()
 
     file_handler = logging.FileHandler(log_file)
     file_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
+    # QueueHandler formats the message in the caller's thread, since agents log orders and messages that change
+    # afterwards, and only the file write and its lock are left to the background thread
+    records = queue.Queue()
+    _listener = logging.handlers.QueueListener(records, file_handler)
+    _listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(records))
     return logger
 
+
+@atexit.register
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 class DummyLogger:
+    def isEnabledFor(self, level): return False
     def debug(self, msg, *args, **kwargs): pass
     def info(self, msg, *args, **kwargs): pass
     def warning(self, msg, *args, **kwargs): pass